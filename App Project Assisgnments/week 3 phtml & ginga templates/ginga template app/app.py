@@ -1,7 +1,10 @@
 from jinja2 import Template
 import sys
 import csv
-import matplotlib.pyplot as plt
+import os
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from marks_stats import summarize
 
  
 templates='''<!DOCTYPE html>
@@ -74,13 +77,20 @@ def courseDetail(position, value):
 			l.append(float(row[-1]))
 	if not l:
 		return wrongInput()
-	avg = round(sum(l)/len(l),1)
-	Max = int(max(l))
-	plt.hist(sorted(l))
-	plt.ylabel('Frequency')
-	plt.xlabel('Marks')
-	plt.savefig('img.png')
-	# plt.show()
+	summary = summarize(l)
+	avg = round(summary['mean'],1)
+	Max = int(summary['max'])
+	# One image per course, drawn on its own figure and only again when data.csv changed
+	image = 'img-' + value + '.png'
+	if not os.path.exists(image) or os.path.getmtime(image) < os.path.getmtime('data.csv'):
+		fig = Figure()
+		FigureCanvasAgg(fig)
+		ax = fig.add_subplot()
+		counts, edges = summary['histogram']
+		ax.stairs(counts, edges, fill=True)
+		ax.set_ylabel('Frequency')
+		ax.set_xlabel('Marks')
+		fig.savefig(image)
 
 	htmldata ='''
 	<div>
@@ -95,12 +105,12 @@ def courseDetail(position, value):
 				<td>{{Max}}</td>
 			</tr>
 		</table>
-		<img src="img.png" >
+		<img src="{{image}}" >
 	</div>
 	'''
 	html = templates.replace('--data--',htmldata)
 	my_statement = Template(html)
-	out = my_statement.render(title = 'Student Details',avg=avg, Max=Max )
+	out = my_statement.render(title = 'Student Details',avg=avg, Max=Max, image=image )
 	return out
 
 
@@ -1,13 +1,28 @@
-import csv
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+import os
+import sys
 
 from flask import Flask
 from flask import render_template
 from flask import request
+from flask import make_response
+from flask import url_for
+
+# metrics.py is shared by the apps of this repository and lives at its top
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from metrics import Metrics
+from marks_store import MarksStore
+from histograms import HistogramCache
+from marks_aggregates import MarksAggregates
 
 app = Flask(__name__)
+# Runtime metrics at /metrics
+metrics = Metrics(app)
+# data.csv is loaded once and reloaded incrementally when it changes
+store = MarksStore(os.path.join(app.root_path, "data.csv"))
+# Student totals and course summaries, brought up to date with the store's new rows
+aggregates = MarksAggregates(store)
+# Course histograms, rendered by a worker pool and cached in memory and in the instance folder
+histograms = HistogramCache(os.path.join(app.instance_path, "histograms"))
 
 @app.route('/', methods = ["GET", "POST"])
 def hello_world():
@@ -16,59 +31,59 @@ def hello_world():
     elif request.method == "POST":
         id = request.form["ID"]
         b = request.form["id_value"]
-        temp = []
-        courses = []#
-        students = []#
-        marks = []
-        fields = []
-        all = []
         total_marks = 0
         average_marks = 0
         maximum_marks = 0
-        
-        with open("data.csv", 'r') as csvfile:
-            csvreader = csv.reader(csvfile)
-            fields = next(csvreader)
-            
-            for row in csvreader:
-                all.append(row)
-                students.append(row[0])#
-                courses.append(row[1].lstrip())#
     
-        if b == "" or not b.isnumeric():
+        # Ids are ASCII digits, isnumeric() alone lets through "½" or "²" that int() refuses
+        if not (b.isascii() and b.isdigit()):
             return render_template("error.html", template_folder="templates")
         
+        store.refresh()
+        aggregates.sync()
+        
         if id == "student_id":
             if b[0] != "1":
                 return render_template("error.html", template_folder="templates")
             else:
-                for i in all: 
-                    if i[0] == b:
-                        temp.append(i)
-                        total_marks += int(i[2])
-                return render_template("student.html", template_folder="templates", fields = fields, temp = temp, total_marks = total_marks)
+                temp = store.student_rows(int(b))
+                total_marks = aggregates.student_total(int(b))
+                return render_template("student.html", template_folder="templates", fields = store.fields, temp = temp, total_marks = total_marks)
                 
         elif id == "course_id":
 
          if b[0] != "2":
              return render_template("error.html", template_folder="templates")
          else:
-             for i in all:
-                 if i[1].lstrip() == b:
-                     temp.append(i)
-                     total_marks += int(i[2])
-                     marks.append(int(i[2]))
-                     if maximum_marks < int(i[2]):
-                         maximum_marks = int(i[2])
-            
-             if(len(temp) != 0):
-                 average_marks = total_marks / len(temp)
-             plt.hist(marks)
-             plt.xlabel('Marks')
-             plt.ylabel('Frequency')
-             plt.savefig('static/hist.png')
-             plt.clf()
-             return render_template("course.html", template_folder="templates", average_marks = average_marks, maximum_marks = maximum_marks, plot = "static/hist.png")
+             summary = aggregates.course_summary(int(b))
+             histogram = None
+             if summary is not None:
+                 average_marks = summary["mean"]
+                 maximum_marks = summary["max"]
+                 histogram = summary["histogram"]
+             # The image is rendered in the background while the page is sent,
+             # its URL changes with the marks of the course
+             digest = histograms.submit(int(b), histogram)
+             plot = url_for("course_histogram", course_id = int(b), v = digest)
+             return render_template("course.html", template_folder="templates", average_marks = average_marks, maximum_marks = maximum_marks, plot = plot)
+
+
+@app.route('/course/<int:course_id>/hist.png')
+def course_histogram(course_id):
+    store.refresh()
+    aggregates.sync()
+    summary = aggregates.course_summary(course_id)
+    image, digest = histograms.get(course_id, summary["histogram"] if summary is not None else None)
+    response = make_response(image)
+    response.mimetype = "image/png"
+    response.set_etag(digest)
+    if request.args.get("v") == digest:
+        # A versioned URL always names the same image
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 	
 if __name__ == "__main__":
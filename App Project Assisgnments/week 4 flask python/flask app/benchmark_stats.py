@@ -0,0 +1,119 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from marks_stats import grouped, summarize
+
+# Course statistics on a large marks file: the per-row Python loops hello_world()
+# used against marks_stats on NumPy arrays.
+#
+#   python benchmark_stats.py --rows 10000000
+
+
+def generate(path, rows, students, courses, seed, chunk = 1000000):
+    # Same layout as data.csv: "Student id, Course id, Marks"
+    rng = np.random.default_rng(seed)
+    with open(path, "w") as f:
+        f.write("Student id, Course id, Marks\n")
+        for start in range(0, rows, chunk):
+            size = min(chunk, rows - start)
+            block = np.column_stack((
+                rng.integers(1001, 1001 + students, size),
+                rng.integers(2001, 2001 + courses, size),
+                rng.integers(0, 101, size)
+            ))
+            np.savetxt(f, block, fmt = "%d", delimiter = ", ")
+
+
+def load(path):
+    # The whole file in one parse: every line holds three integers
+    with open(path, "rb") as f:
+        f.readline()
+        data = f.read()
+    values = np.fromstring(data.replace(b"\n", b","), dtype = np.int64, sep = ",").reshape(-1, 3)
+    return values[:, 1].astype(np.int32), values[:, 2].astype(np.int32)
+
+
+# The loops of the week 4 app, which read and converted every row on each request
+def python_one_course(path, course_id):
+    total_marks = 0
+    maximum_marks = 0
+    count = 0
+    with open(path) as csvfile:
+        csvreader = csv.reader(csvfile)
+        next(csvreader)
+        for row in csvreader:
+            if row[1].lstrip() == course_id:
+                count += 1
+                total_marks += int(row[2])
+                if maximum_marks < int(row[2]):
+                    maximum_marks = int(row[2])
+    return total_marks / count if count else 0, maximum_marks
+
+
+def python_all_courses(path):
+    totals = {}
+    with open(path) as csvfile:
+        csvreader = csv.reader(csvfile)
+        next(csvreader)
+        for row in csvreader:
+            mark = int(row[2])
+            total = totals.setdefault(row[1].lstrip(), [0, 0, 0])
+            total[0] += mark
+            total[1] += 1
+            if total[2] < mark:
+                total[2] = mark
+    return dict((course, (t[0] / t[1], t[2])) for course, t in totals.items())
+
+
+def timed(function, *args):
+    begin = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - begin
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the course statistics on a large marks file.")
+    parser.add_argument("--rows", type = int, default = 10000000)
+    parser.add_argument("--students", type = int, default = 100000)
+    parser.add_argument("--courses", type = int, default = 500)
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--file", default = "benchmark_marks.csv", help = "generated when it does not exist")
+    parser.add_argument("--skip-python", action = "store_true", help = "only time the NumPy path")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file):
+        _, seconds = timed(generate, args.file, args.rows, args.students, args.courses, args.seed)
+        print("generated %s in %.1fs" % (args.file, seconds), file = sys.stderr)
+
+    course_id = 2001
+    report = {"rows": args.rows, "courses": args.courses, "numpy": np.__version__, "python": sys.version.split()[0]}
+
+    (courses, marks), report["numpy_load_s"] = timed(load, args.file)
+    one, report["numpy_one_course_s"] = timed(lambda: summarize(marks[courses == course_id]))
+    every, report["numpy_all_courses_s"] = timed(grouped, courses, marks)
+
+    if not args.skip_python:
+        (average, maximum), report["python_one_course_s"] = timed(python_one_course, args.file, str(course_id))
+        totals, report["python_all_courses_s"] = timed(python_all_courses, args.file)
+
+        # Both paths should agree before their timings mean anything
+        assert abs(average - one["mean"]) < 1e-9 and maximum == one["max"]
+        assert len(totals) == len(every)
+        for course, (average, maximum) in totals.items():
+            assert abs(average - every[int(course)]["mean"]) < 1e-9 and maximum == every[int(course)]["max"]
+
+        report["speedup_one_course"] = round(report["python_one_course_s"] / report["numpy_one_course_s"], 1)
+        report["speedup_all_courses"] = round(report["python_all_courses_s"] / report["numpy_all_courses_s"], 1)
+        # With the NumPy path paying for its own parse of the file as well
+        report["speedup_all_courses_with_load"] = round(report["python_all_courses_s"] / (report["numpy_load_s"] + report["numpy_all_courses_s"]), 1)
+
+    for key, value in report.items():
+        if key.endswith("_s"):
+            report[key] = round(value, 4)
+    print(json.dumps(report, indent = 2))
@@ -0,0 +1,125 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Histogram images of the course marks.
+#
+# An image is keyed by the course and a digest of its histogram, the bin counts
+# and edges of the course summary, so it is rendered once per version of the
+# data and never overwritten while someone reads it.
+# Rendering runs in a small worker pool with its own Figure every time, nothing
+# touches pyplot's shared global figure. Finished images are kept in a bounded
+# in-memory LRU and in a bounded directory on disk that survives restarts.
+
+
+def histogram_digest(histogram):
+    return hashlib.sha1(repr(histogram).encode()).hexdigest()[:16]
+
+
+def render(histogram):
+    # histogram: (counts, edges) of a course summary, None for a course without marks
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    # The bin counts come from the statistics module, matplotlib only draws them
+    if histogram is not None:
+        counts, edges = histogram
+        axes.stairs(counts, edges, fill = True)
+    axes.set_xlabel('Marks')
+    axes.set_ylabel('Frequency')
+    output = io.BytesIO()
+    figure.savefig(output, format = "png")
+    return output.getvalue()
+
+
+class HistogramCache:
+    def __init__(self, directory, max_entries = 256, max_files = 4096, workers = 2):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_files = max_files
+        self.entries = OrderedDict()
+        # Renders in progress, so that concurrent requests for one image share them
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "histogram")
+        os.makedirs(directory, exist_ok = True)
+
+    def path(self, course_id, digest):
+        return os.path.join(self.directory, "hist-%d-%s.png" % (course_id, digest))
+
+    def submit(self, course_id, histogram):
+        # Starts rendering in the background if the image is not cached yet,
+        # returns the digest the image URL is versioned with
+        digest = histogram_digest(histogram)
+        key = (course_id, digest)
+        with self.lock:
+            if key in self.entries or key in self.pending:
+                return digest
+            if os.path.exists(self.path(course_id, digest)):
+                return digest
+            self.pending[key] = self.executor.submit(self.build, key, histogram)
+        return digest
+
+    def get(self, course_id, histogram):
+        # PNG bytes and digest, waits for the worker when the image is being rendered
+        digest = self.submit(course_id, histogram)
+        key = (course_id, digest)
+        with self.lock:
+            image = self.entries.get(key, None)
+            if image is not None:
+                self.entries.move_to_end(key)
+                return image, digest
+            future = self.pending.get(key, None)
+
+        if future is not None:
+            return future.result(), digest
+
+        try:
+            with open(self.path(course_id, digest), "rb") as f:
+                image = f.read()
+        except FileNotFoundError:
+            # Evicted from the directory since submit() looked
+            return self.executor.submit(self.build, key, histogram).result(), digest
+        self.remember(key, image)
+        return image, digest
+
+    def build(self, key, histogram):
+        try:
+            image = render(histogram)
+            # Written under a temporary name and renamed, readers never see half a file
+            path = self.path(*key)
+            temporary = path + ".%d.tmp" % threading.get_ident()
+            with open(temporary, "wb") as f:
+                f.write(image)
+            os.replace(temporary, path)
+            self.remember(key, image)
+            self.evict_files()
+            return image
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def remember(self, key, image):
+        with self.lock:
+            self.entries[key] = image
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last = False)
+
+    def evict_files(self):
+        # Oldest images first once the directory holds more than max_files
+        names = [name for name in os.listdir(self.directory) if name.endswith(".png")]
+        if len(names) <= self.max_files:
+            return
+        paths = sorted((os.path.join(self.directory, name) for name in names), key = os.path.getmtime)
+        for path in paths[:len(paths) - self.max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,96 @@
+import threading
+
+import numpy as np
+
+from marks_stats import as_array, summarize_counts
+
+# Totals and summaries kept up to date with a MarksStore.
+#
+# sync() folds the rows the store got since the last call into per-student
+# totals and per-course mark counts, with NumPy over the new rows and a dict
+# update per distinct student or (course, mark) pair. A course summary is worked
+# out from its mark counts on first use and kept until new marks arrive for
+# that course, so the request path only does dict lookups. A full reload of the
+# store starts the aggregates over.
+
+
+class MarksAggregates:
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.reloads = None
+        self.position = 0
+        self.version = None
+        self.reset()
+
+    def reset(self):
+        self.position = 0
+        # student id -> total marks
+        self.student_totals = {}
+        # course id -> {mark: count}
+        self.course_counts = {}
+        # course id -> summary, dropped for the courses that get new marks
+        self.summaries = {}
+
+    def sync(self):
+        # Cheap when the store did not change: one comparison
+        if self.version == self.store.version:
+            return
+        with self.lock:
+            reloads, version, students, courses, marks = self.store.rows_since(self.position)
+            if reloads != self.reloads:
+                self.reset()
+                reloads, version, students, courses, marks = self.store.rows_since(0)
+            self.fold(students, courses, marks)
+            self.position += len(marks)
+            self.reloads = reloads
+            self.version = version
+
+    def fold(self, students, courses, marks):
+        if len(marks) == 0:
+            return
+        students = as_array(students)
+        courses = as_array(courses)
+        marks = as_array(marks)
+
+        ids, inverse = np.unique(students, return_inverse = True)
+        totals = np.bincount(inverse, weights = marks)
+        student_totals = self.student_totals
+        for student_id, total in zip(ids.tolist(), totals.tolist()):
+            student_totals[student_id] = student_totals.get(student_id, 0) + int(total)
+
+        # A (course, mark) pair packed in one int64, which np.unique sorts much
+        # faster than rows of a 2-D array, when the ranges of the ids and marks allow it
+        first_course, first_mark = int(courses.min()), int(marks.min())
+        span = int(marks.max()) - first_mark + 1
+        if (int(courses.max()) - first_course + 1) * span < 1 << 63:
+            keys = (courses.astype(np.int64) - first_course) * span + (marks.astype(np.int64) - first_mark)
+            keys, counts = np.unique(keys, return_counts = True)
+            course_ids = (keys // span + first_course).tolist()
+            pair_marks = (keys % span + first_mark).tolist()
+        else:
+            pairs, counts = np.unique(np.stack((courses, marks), axis = 1), axis = 0, return_counts = True)
+            course_ids = pairs[:, 0].tolist()
+            pair_marks = pairs[:, 1].tolist()
+        course_counts = self.course_counts
+        for course_id, mark, count in zip(course_ids, pair_marks, counts.tolist()):
+            counted = course_counts.setdefault(course_id, {})
+            counted[mark] = counted.get(mark, 0) + count
+            self.summaries.pop(course_id, None)
+
+    # Lookups
+    def student_total(self, student_id):
+        return self.student_totals.get(student_id, 0)
+
+    def course_summary(self, course_id):
+        # None for a course without marks
+        summary = self.summaries.get(course_id, None)
+        if summary is not None:
+            return summary
+        with self.lock:
+            counted = self.course_counts.get(course_id, None)
+            if counted is None:
+                return None
+            summary = summarize_counts(np.array(list(counted.keys())), np.array(list(counted.values())))
+            self.summaries[course_id] = summary
+        return summary
@@ -0,0 +1,181 @@
+import numpy as np
+
+# Course statistics on NumPy arrays of marks.
+#
+# grouped() computes every statistic of every course with whole-array
+# operations and no Python loop over rows. Integer marks, the usual case, are
+# counted into a (course, mark) frequency table with one np.bincount and all
+# statistics are read off that small table. Other marks are sorted by course
+# and mark once, then summed with np.add.reduceat and indexed for the order
+# statistics. Both match np.mean, np.std, np.percentile and np.histogram run on
+# each course on its own.
+
+PERCENTILES = (25, 50, 75, 90)
+BINS = 10
+# Largest (course, mark) frequency table, beyond it the marks are sorted instead
+MAX_TABLE_CELLS = 1 << 25
+
+
+def as_array(values):
+    # Lists, array.array and NumPy arrays alike, without a copy when possible
+    if isinstance(values, np.ndarray):
+        return values
+    try:
+        return np.frombuffer(values, dtype = np.dtype(values.typecode))
+    except (AttributeError, TypeError):
+        return np.asarray(values)
+
+
+def summarize(marks, bins = BINS, percentiles = PERCENTILES):
+    # Statistics of one course, None when there are no marks
+    marks = as_array(marks)
+    if len(marks) == 0:
+        return None
+    return grouped(np.zeros(len(marks), dtype = np.int64), marks, bins, percentiles)[0]
+
+
+def grouped(courses, marks, bins = BINS, percentiles = PERCENTILES):
+    # Statistics of every course in one pass: {course id: summary}
+    courses = as_array(courses)
+    marks = as_array(marks)
+    if len(marks) == 0:
+        return {}
+
+    quantiles = sorted(set(percentiles) | {50})
+    integral = np.issubdtype(marks.dtype, np.integer)
+    if integral:
+        first_course, first_mark = int(courses.min()), int(marks.min())
+        width = int(courses.max()) - first_course + 1
+        span = int(marks.max()) - first_mark + 1
+    if integral and width * span <= MAX_TABLE_CELLS:
+        stats = counted(courses, marks, first_course, width, first_mark, span, bins, quantiles)
+    else:
+        stats = sorted_stats(courses, marks, bins, quantiles)
+
+    return summaries_of(stats, int if integral else float, percentiles)
+
+
+def summarize_counts(marks, counts, bins = BINS, percentiles = PERCENTILES):
+    # Statistics of one course from how many times each mark occurs, without
+    # the rows: marks are the distinct marks, counts how often each one was given
+    marks = as_array(marks)
+    counts = as_array(counts)
+    present = counts > 0
+    if not present.any():
+        return None
+    order = np.argsort(marks[present])
+    table = counts[present][order][None, :]
+    marks_axis = marks[present][order].astype(np.float64)
+    stats = table_stats(np.zeros(1, dtype = np.int64), table, marks_axis, bins, sorted(set(percentiles) | {50}))
+    number = int if np.issubdtype(marks.dtype, np.integer) else float
+    return summaries_of(stats, number, percentiles)[0]
+
+
+def summaries_of(stats, number, percentiles):
+    ids, counts, sums, means, stds, minimums, maximums, values, histogram_counts, edges = stats
+    summaries = {}
+    for i, course in enumerate(ids.tolist()):
+        summaries[course] = {
+            "count": int(counts[i]),
+            "total": number(sums[i]),
+            "mean": float(means[i]),
+            "min": number(minimums[i]),
+            "max": number(maximums[i]),
+            "median": float(values[50][i]),
+            "std": float(stds[i]),
+            "percentiles": dict((q, float(values[q][i])) for q in percentiles),
+            "histogram": (histogram_counts[i].tolist(), edges[i].tolist())
+        }
+    return summaries
+
+
+def counted(courses, marks, first_course, width, first_mark, span, bins, quantiles):
+    # One pass over the rows: how many times each course got each mark
+    cells = (courses.astype(np.int64) - first_course) * span + (marks.astype(np.int64) - first_mark)
+    table = np.bincount(cells, minlength = width * span).reshape(width, span)
+    present = table.any(axis = 1)
+    ids = np.flatnonzero(present) + first_course
+    marks_axis = first_mark + np.arange(span, dtype = np.float64)
+    return table_stats(ids, table[present], marks_axis, bins, quantiles)
+
+
+def table_stats(ids, table, marks_axis, bins, quantiles):
+    # table[i, j]: how many times course ids[i] got the mark marks_axis[j], the
+    # marks in increasing order
+    span = len(marks_axis)
+    counts = table.sum(axis = 1)
+    sums = table @ marks_axis
+    means = sums / counts
+    deviations = marks_axis[None, :] - means[:, None]
+    stds = np.sqrt((table * deviations * deviations).sum(axis = 1) / counts)
+    seen = table > 0
+    minimums = marks_axis[seen.argmax(axis = 1)]
+    maximums = marks_axis[span - 1 - seen[:, ::-1].argmax(axis = 1)]
+
+    # The k-th smallest mark of a course is the first mark whose running count passes k
+    cumulative = table.cumsum(axis = 1)
+    def ranked(k):
+        return marks_axis[(cumulative <= k[:, None]).sum(axis = 1)]
+
+    values = {}
+    for q in quantiles:
+        position = (counts - 1) * (q / 100.0)
+        below = np.floor(position)
+        low = ranked(below)
+        high = ranked(np.minimum(below + 1, counts - 1))
+        values[q] = low + (high - low) * (position - below)
+
+    low, high, edges = bin_edges(minimums, maximums, bins)
+    group = np.repeat(np.arange(len(ids)), span)
+    index = bin_index(np.tile(marks_axis, len(ids)), group, low, high, edges, bins)
+    histogram_counts = np.bincount(group * bins + index, weights = table.ravel(), minlength = len(ids) * bins)
+    histogram_counts = histogram_counts.astype(np.int64).reshape(len(ids), bins)
+    return ids, counts, sums, means, stds, minimums, maximums, values, histogram_counts, edges
+
+
+def sorted_stats(courses, marks, bins, quantiles):
+    order = np.lexsort((marks, courses))
+    courses = courses[order]
+    marks = marks[order].astype(np.float64)
+
+    ids, starts, counts = np.unique(courses, return_index = True, return_counts = True)
+    sums = np.add.reduceat(marks, starts)
+    means = sums / counts
+    deviations = marks - np.repeat(means, counts)
+    stds = np.sqrt(np.add.reduceat(deviations * deviations, starts) / counts)
+    minimums = marks[starts]
+    maximums = marks[starts + counts - 1]
+
+    # Linear interpolation between the closest ranks, np.percentile's default
+    values = {}
+    for q in quantiles:
+        position = (counts - 1) * (q / 100.0)
+        below = np.floor(position).astype(np.int64)
+        low = marks[starts + below]
+        high = marks[starts + np.minimum(below + 1, counts - 1)]
+        values[q] = low + (high - low) * (position - below)
+
+    low, high, edges = bin_edges(minimums, maximums, bins)
+    group = np.repeat(np.arange(len(ids)), counts)
+    index = bin_index(marks, group, low, high, edges, bins)
+    histogram_counts = np.bincount(group * bins + index, minlength = len(ids) * bins).reshape(len(ids), bins)
+    return ids, counts, sums, means, stds, minimums, maximums, values, histogram_counts, edges
+
+
+def bin_edges(minimums, maximums, bins):
+    # Equal width bins between each course's minimum and maximum, as np.histogram.
+    # A course whose marks are all equal gets the range mark - 0.5 to mark + 0.5
+    flat = minimums == maximums
+    low = np.where(flat, minimums - 0.5, minimums)
+    high = np.where(flat, maximums + 0.5, maximums)
+    edges = low[:, None] + (high - low)[:, None] * (np.arange(bins + 1) / bins)
+    return low, high, edges
+
+
+def bin_index(values, group, low, high, edges, bins):
+    scaled = (values - low[group]) / (high - low)[group] * bins
+    index = np.clip(np.floor(scaled).astype(np.int64), 0, bins - 1)
+    # Values that land on an edge by rounding go to the bin np.histogram puts them in
+    index -= (index > 0) & (values < edges[group, index])
+    index += (index < bins - 1) & (values >= edges[group, index + 1])
+    return index
@@ -0,0 +1,192 @@
+import array
+import os
+import threading
+
+# Marks of data.csv held in memory, column by column.
+#
+# Every column is a typed array (8 bytes an id and 4 bytes a mark instead of a
+# str object per cell) and the hash indexes map a student or course id to an array of row
+# positions, so a lookup touches only the matching rows. The file is loaded
+# once; when it grows and the last bytes loaded are still the same, only the
+# bytes appended since the last load are parsed. A file that was replaced,
+# shrank, kept its size or was rewritten in place is loaded again in full.
+# A last line without a newline is read as a row when it is complete; if the
+# next bytes written continue that line instead of starting a new one, the
+# file is loaded again in full.
+
+READ_SIZE = 1 << 20
+# Bytes at the end of the loaded part compared with the file to tell an append from a rewrite
+CHECK_SIZE = 1 << 12
+
+
+class MarksStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.fields = []
+        self.students = array.array("q")
+        self.courses = array.array("q")
+        self.marks = array.array("i")
+        # id -> array of row positions
+        self.by_student = {}
+        self.by_course = {}
+        # Bytes of the file loaded so far, always at the end of a line
+        self.offset = 0
+        # The last CHECK_SIZE bytes loaded
+        self.loaded_tail = b""
+        # The last row came from a line without a newline at the end of the file
+        self.unterminated = False
+        self.stat = None
+        # Bumped on every change of the data, caches of derived values key on it
+        self.version = 0
+        # Bumped when the file is loaded again from the start
+        self.reloads = 0
+        self.skipped = 0
+
+    def __len__(self):
+        return len(self.marks)
+
+    def refresh(self):
+        # Cheap when nothing changed: one stat call
+        stat = os.stat(self.path)
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key == self.stat:
+            return False
+
+        with self.lock:
+            if key == self.stat:
+                return False
+            # Only a file that grew and still holds the loaded bytes is read incrementally
+            appended = self.stat is not None and stat.st_ino == self.stat[0] and stat.st_size > self.stat[2]
+            if not (appended and self.prefix_unchanged() and self.skip_newline()):
+                self.clear()
+            self.load()
+            self.stat = key
+            self.version += 1
+        return True
+
+    def clear(self):
+        self.fields = []
+        self.students = array.array("q")
+        self.courses = array.array("q")
+        self.marks = array.array("i")
+        self.by_student = {}
+        self.by_course = {}
+        self.offset = 0
+        self.loaded_tail = b""
+        self.unterminated = False
+        self.skipped = 0
+        self.reloads += 1
+
+    def prefix_unchanged(self):
+        # An append leaves the loaded bytes as they were, the last of them are
+        # compared with what the file now holds at the same place
+        tail = self.loaded_tail
+        with open(self.path, "rb") as f:
+            f.seek(self.offset - len(tail))
+            return f.read(len(tail)) == tail
+
+    def skip_newline(self):
+        # After an unterminated last row the appended bytes must start with the
+        # newline that ends it, anything else means the row was still being written
+        if not self.unterminated:
+            return True
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            start = f.read(2)
+        if start.startswith(b"\r\n"):
+            self.consume(b"\r\n")
+        elif start.startswith(b"\n"):
+            self.consume(b"\n")
+        else:
+            return False
+        self.unterminated = False
+        return True
+
+    def load(self):
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            rest = b""
+            while True:
+                block = f.read(READ_SIZE)
+                if not block:
+                    break
+                block = rest + block
+                end = block.rfind(b"\n") + 1
+                # A line still being written stays in the file for the next load
+                self.add_lines(block[:end])
+                self.consume(block[:end])
+                rest = block[end:]
+            # The file does not end with a newline, its last line is a row when it
+            # holds all three values
+            if rest and self.fields and complete_row(rest):
+                self.add_lines(rest)
+                self.consume(rest)
+                self.unterminated = True
+
+    def consume(self, data):
+        self.offset += len(data)
+        self.loaded_tail = (self.loaded_tail + data[-CHECK_SIZE:])[-CHECK_SIZE:]
+
+    def add_lines(self, data):
+        students = self.students
+        courses = self.courses
+        marks = self.marks
+
+        for line in data.splitlines():
+            if not self.fields:
+                self.fields = [name.strip() for name in line.decode("utf-8-sig").split(",")]
+                continue
+            values = line.split(b",")
+            try:
+                student_id, course_id, mark = int(values[0]), int(values[1]), int(values[2])
+            except (ValueError, IndexError):
+                # Blank or malformed line
+                self.skipped += 1
+                continue
+
+            position = len(marks)
+            try:
+                students.append(student_id)
+                courses.append(course_id)
+                marks.append(mark)
+            except OverflowError:
+                # A value beyond its column's type, the columns stay the same length
+                del students[position:], courses[position:], marks[position:]
+                self.skipped += 1
+                continue
+            index(self.by_student, student_id).append(position)
+            index(self.by_course, course_id).append(position)
+
+    # Lookups, O(matching rows)
+    def student_rows(self, student_id):
+        with self.lock:
+            positions = self.by_student.get(student_id, ())
+            return [(self.students[i], self.courses[i], self.marks[i]) for i in positions]
+
+    def course_marks(self, course_id):
+        with self.lock:
+            positions = self.by_course.get(course_id, ())
+            return array.array("i", [self.marks[i] for i in positions])
+
+    def rows_since(self, position):
+        # Copies of the columns from row position on, for derived data that follows the store
+        with self.lock:
+            return self.reloads, self.version, self.students[position:], self.courses[position:], self.marks[position:]
+
+
+def complete_row(line):
+    values = line.split(b",")
+    try:
+        int(values[0]), int(values[1]), int(values[2])
+    except (ValueError, IndexError):
+        return False
+    return True
+
+
+def index(positions, key):
+    found = positions.get(key, None)
+    if found is None:
+        found = array.array("I")
+        positions[key] = found
+    return found
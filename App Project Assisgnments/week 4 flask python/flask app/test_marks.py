@@ -0,0 +1,231 @@
+import math
+import os
+
+import numpy as np
+import pytest
+
+import marks_stats
+from marks_aggregates import MarksAggregates
+from marks_stats import grouped, summarize, summarize_counts
+from marks_store import MarksStore
+
+# Tests of the marks store, its aggregates, the statistics and the marks page,
+# run from this folder:
+#   python -m pytest test_marks.py
+
+HEADER = b"Student id, Course id, Marks\n"
+
+
+def write(path, data, mode = "wb"):
+    with open(path, mode) as f:
+        f.write(data)
+    # A distinct mtime for every write, even on file systems with a coarse clock
+    write.calls += 1
+    os.utime(path, (write.calls, write.calls))
+
+write.calls = 0
+
+
+def rows(store, student_id):
+    return [row[1:] for row in store.student_rows(student_id)]
+
+
+@pytest.fixture
+def data(tmp_path):
+    return str(tmp_path / "data.csv")
+
+
+def test_append_is_read_incrementally(data):
+    write(data, HEADER + b"1001, 2001, 50\n1002, 2001, 70\n")
+    store = MarksStore(data)
+    assert store.refresh()
+    assert len(store) == 2
+
+    write(data, b"1001, 2002, 90\n", "ab")
+    assert store.refresh()
+    assert store.reloads == 1
+    assert rows(store, 1001) == [(2001, 50), (2002, 90)]
+    assert not store.refresh()
+
+def test_rewrite_at_the_same_size_is_loaded_again(data):
+    write(data, HEADER + b"1001, 2001, 56\n1002, 2001, 70\n")
+    store = MarksStore(data)
+    store.refresh()
+
+    write(data, HEADER + b"1001, 2001, 65\n1002, 2001, 70\n")
+    assert store.refresh()
+    assert store.reloads == 2
+    assert rows(store, 1001) == [(2001, 65)]
+    assert len(store) == 2
+
+def test_rewrite_that_grows_is_loaded_again(data):
+    write(data, HEADER + b"1001, 2001, 56\n")
+    store = MarksStore(data)
+    store.refresh()
+
+    write(data, HEADER + b"1001, 2001, 65\n1002, 2001, 70\n")
+    store.refresh()
+    assert store.reloads == 2
+    assert rows(store, 1001) == [(2001, 65)]
+    assert len(store) == 2
+
+def test_last_row_without_a_newline(data):
+    write(data, HEADER + b"1001, 2001, 50\n1090, 2004, 33")
+    store = MarksStore(data)
+    store.refresh()
+    assert rows(store, 1090) == [(2004, 33)]
+
+    # A newline and more rows are appended after it
+    write(data, b"\n1091, 2004, 10\n", "ab")
+    store.refresh()
+    assert store.reloads == 1
+    assert rows(store, 1090) == [(2004, 33)]
+    assert rows(store, 1091) == [(2004, 10)]
+    assert store.skipped == 0
+
+def test_last_row_still_being_written(data):
+    write(data, HEADER + b"1090, 2004, 3")
+    store = MarksStore(data)
+    store.refresh()
+    assert rows(store, 1090) == [(2004, 3)]
+
+    write(data, b"3\n", "ab")
+    store.refresh()
+    assert rows(store, 1090) == [(2004, 33)]
+    assert len(store) == 1
+
+def test_incomplete_last_line_waits_for_the_rest(data):
+    write(data, HEADER + b"1001, 2001, 50\n1002, 20")
+    store = MarksStore(data)
+    store.refresh()
+    assert len(store) == 1
+
+    write(data, b"01, 70\n", "ab")
+    store.refresh()
+    assert rows(store, 1002) == [(2001, 70)]
+    assert store.skipped == 0
+
+def test_large_ids_and_marks(data):
+    write(data, HEADER + b"4294967296, 2147483648, 50\n1001, 2001, 4294967296\n1002, 2001, 7\n")
+    store = MarksStore(data)
+    store.refresh()
+    assert rows(store, 4294967296) == [(2147483648, 50)]
+    # A mark beyond 32 bits is skipped, the columns stay aligned
+    assert store.skipped == 1
+    assert rows(store, 1002) == [(2001, 7)]
+    assert len(store.students) == len(store.courses) == len(store.marks) == 2
+
+
+@pytest.mark.parametrize("value", ["1½", "2²", "", "-1", "1001a"])
+def test_marks_page_shows_the_error_page_for_bad_ids(value):
+    from app import app
+    for kind in ("student_id", "course_id"):
+        response = app.test_client().post("/", data = {"ID": kind, "id_value": value})
+        assert response.status_code == 200
+        assert b"Wrong Inputs" in response.data
+
+
+# Statistics and aggregates
+def same_summary(summary, expected):
+    assert summary["count"] == expected["count"]
+    for key in ("min", "max"):
+        assert summary[key] == expected[key], key
+    # Floats summed in another order may differ in the last digits
+    for key in ("total", "mean", "median", "std"):
+        assert math.isclose(summary[key], expected[key], rel_tol = 1e-9, abs_tol = 1e-9), key
+    for q, value in expected["percentiles"].items():
+        assert math.isclose(summary["percentiles"][q], value, rel_tol = 1e-9, abs_tol = 1e-9), q
+    assert summary["histogram"][0] == expected["histogram"][0]
+    assert np.allclose(summary["histogram"][1], expected["histogram"][1])
+
+def numpy_summary(marks):
+    counts, edges = np.histogram(marks, marks_stats.BINS)
+    return {
+        "count": len(marks),
+        "total": marks.sum().item(),
+        "mean": float(np.mean(marks)),
+        "min": marks.min().item(),
+        "max": marks.max().item(),
+        "median": float(np.median(marks)),
+        "std": float(np.std(marks)),
+        "percentiles": dict((q, float(np.percentile(marks, q))) for q in marks_stats.PERCENTILES),
+        "histogram": (counts.tolist(), edges.tolist())
+    }
+
+def random_marks(rng, rows):
+    return np.column_stack((
+        rng.integers(1001, 1001 + rows // 5 + 1, rows),
+        rng.integers(2001, 2013, rows),
+        rng.integers(0, 101, rows)
+    ))
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("kind", ["table", "sorted", "float"])
+def test_statistics_match_numpy(seed, kind, monkeypatch):
+    rng = np.random.default_rng(seed)
+    rows = int(rng.integers(1, 3000))
+    courses = rng.integers(1, 40, rows)
+    marks = rng.integers(-20, 101, rows)
+    if kind == "sorted":
+        # Integer marks through the sorted path instead of the frequency table
+        monkeypatch.setattr(marks_stats, "MAX_TABLE_CELLS", 0)
+    if kind == "float":
+        marks = rng.normal(60, 15, rows)
+
+    summaries = grouped(courses, marks)
+    assert sorted(summaries) == sorted(np.unique(courses).tolist())
+    for course, summary in summaries.items():
+        same_summary(summary, numpy_summary(marks[courses == course]))
+
+    one = marks[courses == courses[0]]
+    same_summary(summarize(one), numpy_summary(one))
+    distinct, counts = np.unique(one, return_counts = True)
+    same_summary(summarize_counts(distinct, counts), numpy_summary(one))
+
+def test_statistics_of_a_single_mark():
+    same_summary(summarize(np.array([42])), numpy_summary(np.array([42])))
+    assert summarize(np.array([], dtype = np.int32)) is None
+    assert summarize_counts(np.array([5]), np.array([0])) is None
+
+def check_aggregates(store, aggregates, data):
+    # Against grouped() and plain sums over the whole file, read again from disk
+    values = np.loadtxt(data, dtype = np.int64, delimiter = ",", skiprows = 1, ndmin = 2)
+    students, courses, marks = values[:, 0], values[:, 1], values[:, 2]
+    assert aggregates.position == len(store) == len(values)
+    for student in np.unique(students).tolist():
+        assert aggregates.student_total(student) == marks[students == student].sum()
+    for course, expected in grouped(courses, marks).items():
+        same_summary(aggregates.course_summary(course), expected)
+    return students, courses
+
+def test_aggregates_follow_appends_and_reloads(data):
+    rng = np.random.default_rng(3)
+    def lines(rows):
+        return "".join("%d, %d, %d\n" % tuple(row) for row in rows).encode()
+
+    write(data, HEADER + lines(random_marks(rng, 2000)))
+    store = MarksStore(data)
+    aggregates = MarksAggregates(store)
+    store.refresh()
+    aggregates.sync()
+    check_aggregates(store, aggregates, data)
+
+    # New marks for known students and courses and for new ones
+    for i in range(3):
+        block = random_marks(rng, 300)
+        block[:50, 1] = 3001 + i
+        write(data, lines(block), "ab")
+        store.refresh()
+        aggregates.sync()
+        assert store.reloads == 1
+        check_aggregates(store, aggregates, data)
+
+    # A smaller file in place of the old one starts the aggregates over
+    write(data, HEADER + b"1001, 2001, 40\n1001, 2002, 60\n")
+    store.refresh()
+    aggregates.sync()
+    assert store.reloads == 2
+    check_aggregates(store, aggregates, data)
+    assert aggregates.student_total(1002) == 0
+    assert aggregates.course_summary(3001) is None
+    assert aggregates.course_summary(2001)["max"] == 40
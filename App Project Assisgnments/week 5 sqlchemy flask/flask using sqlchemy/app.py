@@ -1,13 +1,96 @@
-from flask import render_template,request,url_for,redirect
+import io
+import os
+import re
+import sys
+import time
+import click
+from flask import render_template,request,url_for,redirect,send_from_directory,abort
+from sqlalchemy import and_,func,literal_column,tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from models import app,Student,Course,Enrollments,db
+# metrics.py is shared by the apps of this repository and lives at its top
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','..','..'))
+from metrics import Metrics,pool_gauges
+from importer import import_students,import_courses,CHUNK_SIZE
+from catalog import catalog
+
+# Runtime metrics at /metrics
+metrics=Metrics(app)
+metrics.gauge('db_pool_connections','Connections of each pool, by state.',pool_gauges(lambda: db.engines))
+
+# Student list
+# Keyset pagination: every sort column has an index ending in student_id, a page
+# seeks past the last (value, student_id) of the previous one, so any page costs
+# the same and there is no OFFSET or COUNT(*) scanning the table.
+# last_name is optional, it is sorted as '' when missing through the matching
+# expression index in models.py, NULLs would stop the seek from using the index.
+# The '' is written inline, a bound parameter would not match the index expression
+SORT_COLUMNS={'student_id':Student.student_id,'roll_number':Student.roll_number,'first_name':Student.first_name,'last_name':func.coalesce(Student.last_name,literal_column("''"))}
+SEARCH_COLUMNS=('roll_number','first_name','last_name')
+PAGE_SIZE=50
+MAX_PAGE_SIZE=200
+
+def prefix_range(column,prefix):
+    # column LIKE 'prefix%' written as a range so that SQLite searches the index.
+    # The upper bound is the prefix with its last character raised by one, a
+    # character that is already the largest one is dropped first
+    head=prefix.rstrip(chr(sys.maxunicode))
+    if not head:
+        return column>=prefix
+    return and_(column>=prefix,column<head[:-1]+chr(ord(head[-1])+1))
+
+def seek(column,value,sid,descending):
+    # Rows after (value, sid) in page order. A row value comparison, SQLite turns
+    # it into an index range where the same test written with OR scans the index.
+    # The extra bound on the column alone is what lets the expression index be searched
+    key=tuple_(column,Student.student_id)
+    if descending:
+        return and_(column<=value,key<tuple_(value,sid))
+    return and_(column>=value,key>tuple_(value,sid))
 
 @app.route("/")
 def index():
-    all=Student.query.all()
-    if all:
-        return render_template('all-students.html',all=all)
+    sort=request.args.get('sort','student_id')
+    if sort not in SORT_COLUMNS:
+        sort='student_id'
+    descending=request.args.get('order')=='desc'
+    field=request.args.get('field','roll_number')
+    if field not in SEARCH_COLUMNS:
+        field='roll_number'
+    q=request.args.get('q','').strip()
+    per_page=max(1,min(request.args.get('per_page',PAGE_SIZE,type=int),MAX_PAGE_SIZE))
+    after_id=request.args.get('after_id',type=int)
+    after=request.args.get('after','')
+
+    query=Student.query
+    if q:
+        # A search also sorts by the searched column, one index range serves both
+        sort=field
+        query=query.filter(prefix_range(SORT_COLUMNS[field],q))
+    column=SORT_COLUMNS[sort]
+    if after_id is not None:
+        query=query.filter(seek(column,after_id if sort=='student_id' else after,after_id,descending))
+    order=[column] if sort=='student_id' else [column,Student.student_id]
+    if descending:
+        order=[c.desc() for c in order]
+
+    # One extra row tells if there is a next page
+    all=query.order_by(*order).limit(per_page+1).all()
+    next_url=None
+    if len(all)>per_page:
+        all=all[:per_page]
+        last=all[-1]
+        next_url=url_for('index',sort=sort,order='desc' if descending else None,field=field if q else None,q=q or None,
+            per_page=per_page,after=(getattr(last,sort) or '') if sort!='student_id' else None,after_id=last.student_id)
+
+    if all or q or after_id is not None:
+        # Each column header sorts by it, a second click reverses the order
+        sort_urls=dict((name,url_for('index',sort=name,order='desc' if (name==sort and not descending) else None,per_page=per_page)) for name in SORT_COLUMNS)
+        return render_template('all-students.html',all=all,next_url=next_url,sort_urls=sort_urls,
+            q=q,field=field,per_page=per_page,first_url=url_for('index',sort=sort,order='desc' if descending else None,field=field if q else None,q=q or None,per_page=per_page))
     else:
-        return "<h1>Student list</h1><p>No student found. Add the student now!</p><a href='/student/create'>+Add student</a>"
+        return "<h1>Student list</h1><p>No student found. Add the student now!</p><a href='/student/create'>+Add student</a> <a href='/import'>Import CSV</a>"
 
 
 @app.route("/student/create",methods=['GET','POST'])
@@ -22,84 +105,120 @@ def add_student():
         if missing is None:
             # If roll number not exists
             s=Student(roll_number=roll,first_name=fname,last_name=lname)
-            db.session.add(s)
-            db.session.commit()
-
-            this_student=Student.query.filter_by(roll_number=roll).first()
-            s_id=this_student.student_id
-            for course in courses:
-                print(course)
-
-                if course=='course_1':
-                    cid=1
-                elif course=='course_2':
-                    cid=2
-                elif course=='course_3':
-                    cid=3
-                elif course=='course_4':
-                    cid=4
-                c=Enrollments(estudent_id=s_id,ecourse_id=cid)
-                db.session.add(c)
+            try:
+                db.session.add(s)
+                # The flush sends the INSERT and fills in student_id, the student and
+                # the enrollments are committed together below
+                db.session.flush()
+                db.session.add_all([Enrollments(estudent_id=s.student_id,ecourse_id=cid) for cid in catalog.ids_for(courses)])
                 db.session.commit()
-
-
+            except IntegrityError:
+                # The same roll number was added by another request in the meantime
+                db.session.rollback()
+                return render_template('user-exist.html')
 
             return redirect(url_for('index'))
         else:
             return render_template('user-exist.html')
-    return render_template('add-student.html')
+    return render_template('add-student.html',courses=catalog.courses())
 
 
-@app.route('/student/<int:student_id>')
-def student_details(student_id):
-    row=Student.query.filter_by(student_id=student_id).first()
+def student_with_courses(student_id):
+    # The student and its courses in one query, 404 when there is no such student
+    student=Student.query.options(joinedload(Student.courses)).filter_by(student_id=student_id).first()
+    if student is None:
+        abort(404)
+    return student
 
-    enrolls=Enrollments.query.with_entities(Enrollments.ecourse_id).filter_by(estudent_id=student_id).all()
-    cid=[]
-    for enroll in enrolls:
-        cid.append(enroll[0])
-    #print(cid)
-    courses=Course.query.filter(Course.course_id.in_(cid)).all()
 
-    return render_template('student-details.html',row=row,courses=courses)
+@app.route('/student/<int:student_id>')
+def student_details(student_id):
+    row=student_with_courses(student_id)
+    return render_template('student-details.html',row=row,courses=row.courses)
 
 
 @app.route('/student/<int:student_id>/update',methods=['GET','POST'])
 def update(student_id):
     if request.method=='GET':
-        this_student=Student.query.filter_by(student_id=student_id).first()
-
-        enrolls_cid=Enrollments.query.with_entities(Enrollments.ecourse_id).filter_by(estudent_id=student_id).all()
-        cid=[]
-        for enroll in enrolls_cid:
-            cid.append(enroll[0])
-        #print(cid)
-        return render_template('update.html',row=this_student,cid=cid)
+        this_student=student_with_courses(student_id)
+        cid=set(course.course_id for course in this_student.courses)
+        return render_template('update.html',row=this_student,cid=cid,courses=catalog.courses())
 
     elif request.method=='POST':
         fname=request.form['f_name']
         lname=request.form['l_name']
         courses=request.form.getlist('courses')
-        s=Student.query.filter_by(student_id=student_id).update(dict(first_name=fname,last_name=lname))
-        db.session.commit()
-
-        Enrollments.query.filter_by(estudent_id=student_id).delete()
+        if Student.query.filter_by(student_id=student_id).update(dict(first_name=fname,last_name=lname))==0:
+            abort(404)
+
+        # Only the courses that changed are written, all in one transaction
+        enrolled=set(cid for (cid,) in Enrollments.query.with_entities(Enrollments.ecourse_id).filter_by(estudent_id=student_id))
+        selected=catalog.ids_for(courses)
+        removed=enrolled-selected
+        if removed:
+            Enrollments.query.filter(Enrollments.estudent_id==student_id,Enrollments.ecourse_id.in_(removed)).delete(synchronize_session=False)
+        db.session.add_all([Enrollments(estudent_id=student_id,ecourse_id=cid) for cid in selected-enrolled])
         db.session.commit()
-        for course in courses:
-            if course=='course_1':
-                cid=1
-            elif course=='course_2':
-                cid=2
-            elif course=='course_3':
-                cid=3
-            elif course=='course_4':
-                cid=4
-            c=Enrollments(estudent_id=student_id,ecourse_id=cid)
-            db.session.add(c)
-            db.session.commit()
         return redirect(url_for('index'))
 
 
+# Bulk import, from the command line:
+#   flask --app app import-courses courses.csv
+#   flask --app app import-students students.csv --rejects rejects.csv
+IMPORTERS={'students':import_students,'courses':import_courses}
+# Rejected rows of the web imports are kept in their own folder, the only one /import/rejects serves
+REJECTS_FOLDER=os.path.join(app.instance_path,'rejects')
+REJECTS_NAME=re.compile(r'rejects-(students|courses)-[0-9]+\.csv')
+
+def import_command(kind):
+    @click.argument('path',type=click.Path(exists=True,dir_okay=False))
+    @click.option('--chunk-size',default=CHUNK_SIZE,show_default=True,help='rows written per transaction')
+    @click.option('--rejects',default=None,type=click.Path(dir_okay=False),help='CSV file for the rejected rows')
+    def command(path,chunk_size,rejects):
+        db.create_all()
+        with open(path,newline='',encoding='utf-8') as f:
+            report=IMPORTERS[kind](f,chunk_size,rejects,progress=lambda report: click.echo(str(report)))
+        click.echo('Done: '+str(report))
+    command.__doc__='Import '+kind+' from a CSV file.'
+    return command
+
+app.cli.command('import-students')(import_command('students'))
+app.cli.command('import-courses')(import_command('courses'))
+
+
+@app.route('/import',methods=['GET','POST'])
+def import_csv():
+    if request.method=='GET':
+        return render_template('import.html')
+
+    kind=request.form.get('kind','students')
+    upload=request.files.get('file')
+    if kind not in IMPORTERS or upload is None:
+        return render_template('import.html',error='Choose what to import and a CSV file.'),400
+
+    # The upload is read as a stream, the rejected rows go to the rejects folder
+    os.makedirs(REJECTS_FOLDER,exist_ok=True)
+    rejects='rejects-%s-%d.csv'%(kind,time.time()*1000)
+    path=os.path.join(REJECTS_FOLDER,rejects)
+    try:
+        stream=io.TextIOWrapper(upload.stream,encoding='utf-8',newline='')
+        report=IMPORTERS[kind](stream,rejects_path=path,progress=lambda report: app.logger.info('import %s: %s',kind,report))
+    except (ValueError,UnicodeDecodeError) as e:
+        return render_template('import.html',error=str(e)),400
+
+    if report.rejected==0:
+        os.remove(path)
+        rejects=None
+    return render_template('import.html',report=report,rejects=rejects)
+
+
+@app.route('/import/rejects/<name>')
+def import_rejects(name):
+    if REJECTS_NAME.fullmatch(name) is None:
+        abort(404)
+    return send_from_directory(REJECTS_FOLDER,name,as_attachment=True)
+
+
 @app.route('/student/<int:student_id>/delete')
 def delete(student_id):
     Student.query.filter_by(student_id=student_id).delete()
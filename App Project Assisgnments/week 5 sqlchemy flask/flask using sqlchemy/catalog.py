@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import event,func
+from sqlalchemy.orm import Session,object_session
+from models import Course,db
+
+# Course catalog cached in memory.
+#
+# The add and update pages list every course and the handlers map the selected
+# course codes to ids, both read this cache instead of querying the course table.
+# Any change to the course table made through a session, ORM objects or bulk
+# statements alike, drops the cache when that session commits. Other processes,
+# e.g. the import-courses command, are noticed by the number of courses and the
+# highest course id, checked at most once every CHECK_INTERVAL seconds, and any
+# other change (a renamed course) shows up after TTL seconds at the latest.
+
+CHECK_INTERVAL=1.0
+TTL=60.0
+
+CatalogCourse=namedtuple('CatalogCourse',['course_id','course_code','course_name'])
+
+
+class CourseCatalog:
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.loaded=None
+        # (number of courses, highest course id) of the loaded catalog
+        self.fingerprint=None
+        self.loaded_at=0.0
+        self.checked_at=0.0
+        # Bumped on every invalidation so that a load which started before a
+        # change can not put the old catalog back
+        self.generation=0
+        self.loads=0
+
+    def get(self):
+        loaded=self.loaded
+        if loaded is not None:
+            if not self.stale():
+                return loaded
+            self.invalidate()
+
+        generation=self.generation
+        rows=db.session.query(Course.course_id,Course.course_code,Course.course_name).order_by(Course.course_code).all()
+        courses=[CatalogCourse(*row) for row in rows]
+        loaded=(courses,dict((course.course_code,course.course_id) for course in courses))
+        with self.lock:
+            self.loads+=1
+            if generation==self.generation:
+                self.loaded=loaded
+                self.fingerprint=(len(courses),max([course.course_id for course in courses],default=None))
+                self.loaded_at=self.checked_at=time.monotonic()
+        return loaded
+
+    def stale(self):
+        # True when the course table changed outside this process
+        now=time.monotonic()
+        if now-self.loaded_at>TTL:
+            return True
+        if now-self.checked_at<CHECK_INTERVAL:
+            return False
+        self.checked_at=now
+        fingerprint=tuple(db.session.query(func.count(Course.course_id),func.max(Course.course_id)).one())
+        return fingerprint!=self.fingerprint
+
+    def courses(self):
+        return self.get()[0]
+
+    def ids(self):
+        # course code -> id
+        return self.get()[1]
+
+    def ids_for(self,codes):
+        ids=self.ids()
+        return set(ids[code] for code in codes if code in ids)
+
+    def invalidate(self):
+        with self.lock:
+            self.generation+=1
+            self.loaded=None
+
+
+catalog=CourseCatalog()
+
+
+# Invalidation
+def mark_changed(session):
+    if session is not None:
+        session.info['catalog_changed']=True
+
+@event.listens_for(Course,'after_insert')
+@event.listens_for(Course,'after_update')
+@event.listens_for(Course,'after_delete')
+def course_flushed(mapper,connection,target):
+    mark_changed(object_session(target))
+
+@event.listens_for(Session,'do_orm_execute')
+def course_statement(orm_execute_state):
+    # Bulk INSERT, UPDATE and DELETE statements on the course table, e.g. from importer.py
+    statement=orm_execute_state.statement
+    table=getattr(statement,'table',None)
+    if (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete) \
+            and getattr(table,'name',None)==Course.__table__.name:
+        mark_changed(orm_execute_state.session)
+
+@event.listens_for(Session,'after_commit')
+def session_committed(session):
+    if session.info.pop('catalog_changed',False):
+        catalog.invalidate()
+
+@event.listens_for(Session,'after_rollback')
+def session_rolled_back(session):
+    session.info.pop('catalog_changed',None)
@@ -0,0 +1,211 @@
+import csv
+import time
+from itertools import islice
+
+from sqlalchemy.dialects.sqlite import insert
+from models import Student,Course,Enrollments,db
+from catalog import catalog
+
+# Streaming CSV import.
+#
+# The file is read in fixed size chunks and every chunk is written in its own
+# transaction, so memory stays flat whatever the file size and an interrupted
+# import keeps the chunks already committed. Running the same file again is safe:
+# students and courses are upserted and enrollments that exist are skipped.
+#
+# Students CSV: roll_number,first_name,last_name,courses
+#   courses holds course codes separated by ';', e.g. CSE01;CSE02
+# Courses CSV: course_code,course_name,course_description
+
+CHUNK_SIZE=5000
+MAX_LENGTH=100
+
+
+class ImportReport:
+    def __init__(self):
+        self.read=0
+        self.imported=0
+        self.rejected=0
+        self.enrollments=0
+        self.started=time.perf_counter()
+
+    def seconds(self):
+        return time.perf_counter()-self.started
+
+    def __str__(self):
+        seconds=self.seconds()
+        rate=int(self.read/seconds) if seconds else 0
+        return '%d rows read, %d imported, %d rejected, %d enrollments added (%.1fs, %d rows/s)'%(
+            self.read,self.imported,self.rejected,self.enrollments,seconds,rate)
+
+
+class Rejects:
+    # Rejected rows with the reason, written to a CSV file only when a path is given
+    def __init__(self,path,fieldnames):
+        self.file=None
+        self.writer=None
+        if path:
+            self.file=open(path,'w',newline='')
+            self.writer=csv.writer(self.file)
+            self.writer.writerow(['line']+list(fieldnames)+['error'])
+        self.fieldnames=fieldnames
+
+    def add(self,line,row,error):
+        if self.writer is not None:
+            self.writer.writerow([line]+[row.get(name,'') for name in self.fieldnames]+[error])
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def chunks(reader,size):
+    # (line number, row) pairs, size at a time. Line 1 is the header
+    numbered=enumerate(reader,start=2)
+    while True:
+        chunk=list(islice(numbered,size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def text(row,name):
+    value=row.get(name)
+    return value.strip() if value else ''
+
+
+def check_header(reader,required):
+    missing=[name for name in required if name not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError('CSV header is missing: '+', '.join(missing))
+
+
+def validate_student(row,courses):
+    roll=text(row,'roll_number')
+    fname=text(row,'first_name')
+    lname=text(row,'last_name')
+    codes=[code.strip() for code in (row.get('courses') or '').split(';') if code.strip()]
+
+    if not roll:
+        return None,'roll_number is required'
+    if not fname:
+        return None,'first_name is required'
+    if max(len(roll),len(fname),len(lname))>MAX_LENGTH:
+        return None,'values should be at most %d characters'%MAX_LENGTH
+    unknown=[code for code in codes if code not in courses]
+    if unknown:
+        return None,'unknown course code '+', '.join(unknown)
+
+    student=dict(roll_number=roll,first_name=fname,last_name=lname or None)
+    return (student,set(courses[code] for code in codes)),None
+
+
+def write_students(students):
+    # students: roll number -> (values, course ids). One upsert for the whole chunk,
+    # the ids of new and existing students come back from RETURNING
+    statement=insert(Student.__table__)
+    statement=statement.on_conflict_do_update(
+        index_elements=['roll_number'],
+        set_=dict(first_name=statement.excluded.first_name,last_name=statement.excluded.last_name)
+    ).returning(Student.student_id,Student.roll_number)
+    ids=dict((roll,sid) for sid,roll in db.session.execute(statement,[values for values,cids in students.values()]))
+
+    pairs=[dict(estudent_id=ids[roll],ecourse_id=cid) for roll,(values,cids) in students.items() for cid in cids]
+    if not pairs:
+        return 0
+    result=db.session.execute(
+        insert(Enrollments.__table__).on_conflict_do_nothing(index_elements=['estudent_id','ecourse_id']),
+        pairs
+    )
+    return result.rowcount
+
+
+def import_students(stream,chunk_size=CHUNK_SIZE,rejects_path=None,progress=None):
+    reader=csv.DictReader(stream)
+    check_header(reader,['roll_number','first_name'])
+    # course code -> id from the cached catalog, courses are few so the whole map fits in memory
+    courses=catalog.ids()
+    report=ImportReport()
+    rejects=Rejects(rejects_path,reader.fieldnames)
+
+    try:
+        for chunk in chunks(reader,chunk_size):
+            students={}
+            for line,row in chunk:
+                report.read+=1
+                student,error=validate_student(row,courses)
+                if error:
+                    report.rejected+=1
+                    rejects.add(line,row,error)
+                    continue
+                values,cids=student
+                # A roll number seen twice in a chunk: the last names win, the courses add up
+                if values['roll_number'] in students:
+                    cids=cids|students[values['roll_number']][1]
+                students[values['roll_number']]=(values,cids)
+                report.imported+=1
+
+            if students:
+                report.enrollments+=write_students(students)
+            db.session.commit()
+            if progress:
+                progress(report)
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        rejects.close()
+    return report
+
+
+def validate_course(row):
+    code=text(row,'course_code')
+    name=text(row,'course_name')
+    description=text(row,'course_description')
+
+    if not code:
+        return None,'course_code is required'
+    if not name:
+        return None,'course_name is required'
+    if max(len(code),len(name),len(description))>MAX_LENGTH:
+        return None,'values should be at most %d characters'%MAX_LENGTH
+    return dict(course_code=code,course_name=name,course_description=description or None),None
+
+
+def import_courses(stream,chunk_size=CHUNK_SIZE,rejects_path=None,progress=None):
+    reader=csv.DictReader(stream)
+    check_header(reader,['course_code','course_name'])
+    report=ImportReport()
+    rejects=Rejects(rejects_path,reader.fieldnames)
+
+    try:
+        for chunk in chunks(reader,chunk_size):
+            courses={}
+            for line,row in chunk:
+                report.read+=1
+                course,error=validate_course(row)
+                if error:
+                    report.rejected+=1
+                    rejects.add(line,row,error)
+                    continue
+                courses[course['course_code']]=course
+                report.imported+=1
+
+            if courses:
+                statement=insert(Course.__table__)
+                db.session.execute(
+                    statement.on_conflict_do_update(
+                        index_elements=['course_code'],
+                        set_=dict(course_name=statement.excluded.course_name,course_description=statement.excluded.course_description)
+                    ),
+                    list(courses.values())
+                )
+            db.session.commit()
+            if progress:
+                progress(report)
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        rejects.close()
+    return report
@@ -1,10 +1,11 @@
+import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 
 #create a Flask Instance
 app=Flask(__name__)
-# Add Database
-app.config['SQLALCHEMY_DATABASE_URI']='sqlite:///database.sqlite3'
+# Add Database, the SQLALCHEMY_DATABASE_URI environment variable points it elsewhere (the tests use it)
+app.config['SQLALCHEMY_DATABASE_URI']=os.environ.get('SQLALCHEMY_DATABASE_URI','sqlite:///database.sqlite3')
 #Initialize the database
 db=SQLAlchemy(app)
 
@@ -14,6 +15,14 @@ class Student(db.Model):
     roll_number=db.Column(db.String(100), nullable=False, unique=True)
     first_name=db.Column(db.String(100), nullable=False)
     last_name=db.Column(db.String(100))
+    # Read only, enrollments are written through the Enrollments model
+    courses=db.relationship('Course',secondary='enrollments',order_by='Course.course_code',viewonly=True)
+    # Sort and prefix search indexes of the student list, roll_number has its unique index.
+    # The list sorts a missing last name as '', hence the expression
+    __table_args__=(
+        db.Index('ix_student_first_name','first_name','student_id'),
+        db.Index('ix_student_last_name',db.func.coalesce(last_name,''),'student_id'),
+    )
 
 class Course(db.Model):
     course_id=db.Column(db.Integer,primary_key=True,autoincrement=True)
@@ -26,3 +35,8 @@ class Enrollments(db.Model):
     enrollment_id=db.Column(db.Integer,primary_key=True,autoincrement=True)
     estudent_id=db.Column(db.Integer, db.ForeignKey('student.student_id'),nullable=False)
     ecourse_id=db.Column(db.Integer, db.ForeignKey('course.course_id'), nullable=False)
+    # One enrollment per student and course, existing databases get these with migrate.py
+    __table_args__=(
+        db.Index('ux_enrollments_student_course','estudent_id','ecourse_id',unique=True),
+        db.Index('ix_enrollments_course_student','ecourse_id','estudent_id'),
+    )
@@ -0,0 +1,149 @@
+import io
+import os
+import re
+import pytest
+from sqlalchemy import event
+
+# The tests run on an in-memory database, set before models.py creates the engine
+#   python -m pytest test_pages.py
+os.environ['SQLALCHEMY_DATABASE_URI']='sqlite://'
+
+import app as pages
+from app import app
+from models import Student,Course,Enrollments,db
+from catalog import catalog
+
+# Statements a page view may run: the student with its courses, plus the
+# course catalog on the update page when the catalog is not cached yet
+QUERY_BUDGET={'details':1,'update':2}
+
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        db.create_all()
+        catalog.invalidate()
+        courses=[Course(course_code='CSE0'+str(i),course_name='Course '+str(i)) for i in range(1,5)]
+        student=Student(roll_number='R1',first_name='Ada',last_name='Lovelace')
+        db.session.add_all(courses+[student])
+        db.session.flush()
+        db.session.add_all([Enrollments(estudent_id=student.student_id,ecourse_id=course.course_id) for course in courses[:3]])
+        db.session.commit()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+        catalog.invalidate()
+
+
+@pytest.fixture
+def queries():
+    # Statements sent to the database while the test runs
+    statements=[]
+    def count(conn,cursor,statement,parameters,context,executemany):
+        statements.append(statement)
+    event.listen(db.engine,'before_cursor_execute',count)
+    yield statements
+    event.remove(db.engine,'before_cursor_execute',count)
+
+
+@pytest.mark.parametrize('page,url',[('details','/student/1'),('update','/student/1/update')])
+def test_page_stays_within_query_budget(client,queries,page,url):
+    response=client.get(url)
+    assert response.status_code==200
+    assert b'CSE03' in response.data
+    assert len(queries)<=QUERY_BUDGET[page],queries
+
+
+@pytest.mark.parametrize('url',['/student/99','/student/99/update'])
+def test_unknown_student_is_404(client,url):
+    assert client.get(url).status_code==404
+
+
+def test_rejects_are_served_only_from_their_folder(client,tmp_path,monkeypatch):
+    monkeypatch.setattr(app,'instance_path',str(tmp_path))
+    monkeypatch.setattr(pages,'REJECTS_FOLDER',str(tmp_path/'rejects'))
+    (tmp_path/'database.sqlite3').write_bytes(b'SQLite format 3')
+
+    upload=io.BytesIO(b'roll_number,first_name,last_name,courses\nR2,Grace,Hopper,CSE01\n,Nameless,,\n')
+    response=client.post('/import',data={'kind':'students','file':(upload,'students.csv')},content_type='multipart/form-data')
+    assert response.status_code==200
+    link=re.search(r'href="(/import/rejects/[^"]+)"',response.data.decode()).group(1)
+    assert re.fullmatch(r'/import/rejects/rejects-students-[0-9]+\.csv',link)
+    response=client.get(link)
+    assert response.status_code==200
+    assert b'Nameless' in response.data
+
+    for name in ('database.sqlite3','rejects-students-1.csv','rejects-students-1.csv.bak','..%2Fdatabase.sqlite3'):
+        assert client.get('/import/rejects/'+name).status_code==404
+
+
+def test_add_student_handles_a_concurrent_insert(client,monkeypatch):
+    # Another request adds the same roll number between the lookup and the INSERT
+    def add_same_roll(session,flush_context,instances):
+        if any(isinstance(obj,Student) and obj.roll_number=='R9' for obj in session.new):
+            with db.engine.connect() as connection:
+                connection.execute(Student.__table__.insert().values(roll_number='R9',first_name='Other'))
+                connection.commit()
+    event.listen(db.session,'before_flush',add_same_roll)
+    try:
+        response=client.post('/student/create',data={'roll':'R9','f_name':'Mine','l_name':'','courses':['CSE01']})
+    finally:
+        event.remove(db.session,'before_flush',add_same_roll)
+    assert response.status_code==200
+    assert b'exist' in response.data.lower()
+    assert [s.first_name for s in Student.query.filter_by(roll_number='R9')]==['Other']
+    assert Enrollments.query.count()==3
+
+
+def test_catalog_sees_courses_added_by_another_process(client,monkeypatch):
+    import catalog as catalog_module
+    now=[1000.0]
+    monkeypatch.setattr(catalog_module.time,'monotonic',lambda: now[0])
+    catalog.invalidate()
+    assert [course.course_code for course in catalog.courses()]==['CSE01','CSE02','CSE03','CSE04']
+
+    # Written outside any session, like the import-courses command in its own process
+    def execute(statement):
+        with db.engine.connect() as connection:
+            connection.execute(statement)
+            connection.commit()
+
+    # A rename keeps the number of courses and the highest id, it shows up after the TTL
+    execute(Course.__table__.update().where(Course.course_code=='CSE01').values(course_name='Renamed'))
+    now[0]+=catalog_module.CHECK_INTERVAL+0.1
+    assert catalog.courses()[0].course_name=='Course 1'
+    now[0]+=catalog_module.TTL
+    assert catalog.courses()[0].course_name=='Renamed'
+
+    # A new course is seen at the next check
+    execute(Course.__table__.insert().values(course_code='CSE05',course_name='Course 5'))
+    assert len(catalog.courses())==4
+    now[0]+=catalog_module.CHECK_INTERVAL+0.1
+    assert [course.course_code for course in catalog.courses()][-1]=='CSE05'
+    assert b'CSE05' in client.get('/student/create').data
+
+
+@pytest.mark.parametrize('q,found',[('Lov',True),('Lov\U0010ffff',False),('\U0010ffff',False),('Lo\U0010ffff\U0010ffff',False)])
+def test_search_accepts_the_largest_character(client,q,found):
+    response=client.get('/',query_string={'q':q,'field':'last_name'})
+    assert response.status_code==200
+    assert (b'Lovelace' in response.data)==found
+
+def test_prefix_range_matches_like():
+    with app.app_context():
+        db.create_all()
+        names=['Ada','Ad\U0010ffff','Ad\U0010ffffz','Ae','\U0010ffff','\U0010ffffa','B']
+        db.session.add_all([Student(roll_number='P'+str(i),first_name=name) for i,name in enumerate(names)])
+        db.session.commit()
+        for prefix in ('A','Ad','Ad\U0010ffff','\U0010ffff','B'):
+            found=[s.first_name for s in Student.query.filter(pages.prefix_range(Student.first_name,prefix))]
+            assert sorted(found)==sorted(name for name in names if name.startswith(prefix)),prefix
+        db.drop_all()
+
+def test_student_list_numbers_rows_by_student_id(client):
+    with app.app_context():
+        db.session.add_all([Student(roll_number='R'+str(i),first_name='F'+str(i)) for i in range(2,6)])
+        db.session.commit()
+    response=client.get('/',query_string={'per_page':2,'after_id':3})
+    cells=re.findall(r'<tr>\s*<td>(\d+)</td>',response.data.decode())
+    assert cells==['4','5']
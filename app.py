@@ -1,16 +1,190 @@
-from flask import Flask, render_template, request, redirect, make_response
-from flask_restful import Resource, Api, fields, marshal_with, reqparse
+from flask import Flask, Response, render_template, request, redirect, make_response, g, has_request_context, current_app, stream_with_context
+from flask_restful import Resource, Api
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from werkzeug.exceptions import HTTPException, NotFound
-import json
+from werkzeug.datastructures import MultiDict
+from collections import OrderedDict
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+import hashlib
+import csv
+import io
+import zlib
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///api_database.sqlite3'
+from metrics import Metrics, pool_gauges
+from serializer import Encoder, dumps, json_response, output_json, stream_array
 
-db = SQLAlchemy()
-db.init_app(app)
-app.app_context().push()
-api = Api(app)
+# Default configuration, create_app(config) overrides any of these
+DEFAULT_CONFIG = {
+    'SQLALCHEMY_DATABASE_URI': 'sqlite:///api_database.sqlite3',
+    # Page size used by the collection endpoints when the client does not ask for one
+    'API_PAGE_SIZE': 100,
+    'API_MAX_PAGE_SIZE': 1000,
+    # Largest array accepted by the batch endpoints
+    'API_MAX_BATCH_SIZE': 50000,
+    # Read-through cache for single course and student reads
+    'COURSE_CACHE_SIZE': 10000,
+    'STUDENT_CACHE_SIZE': 100000,
+    'CACHE_TTL': 300,
+    # Storage profile, see STORAGE_PROFILES below, the STORAGE_PROFILE environment variable wins over it
+    'STORAGE_PROFILE': 'development',
+    # Statement timing, Server-Timing header and slow query log, the SQL_INSTRUMENTATION
+    # environment variable (1 or 0) wins over it
+    'SQL_INSTRUMENTATION': False,
+    'SLOW_QUERY_THRESHOLD_MS': 100,
+    'SLOW_QUERY_LOG': 'slow_queries.log',
+    # Rows fetched from the cursor and written per chunk by the export endpoints
+    'EXPORT_BATCH_SIZE': 1000
+}
+
+
+# Storage profiles
+# The production profile turns on WAL so that readers never wait for the writer,
+# lets a busy connection wait instead of failing with "database is locked", and
+# keeps a single connection write pool next to a separate read only pool.
+STORAGE_PROFILES = {
+    "development": {
+        "pragmas": {},
+        "write_pool_size": None,
+        "read_pool_size": None
+    },
+    "production": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "busy_timeout": 5000,
+            "synchronous": "NORMAL",
+            "mmap_size": 268435456,
+            "cache_size": -65536
+        },
+        # SQLite has one writer at a time, writers queue on the pool instead of on the file lock
+        "write_pool_size": 1,
+        "read_pool_size": 8
+    }
+}
+
+def configure_storage(app):
+    profile = STORAGE_PROFILES[app.config['STORAGE_PROFILE']]
+    
+    if profile["write_pool_size"]:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            "pool_size": profile["write_pool_size"],
+            "max_overflow": 0
+        }
+    if profile["read_pool_size"]:
+        app.config['SQLALCHEMY_BINDS'] = {
+            "read": {
+                "url": app.config['SQLALCHEMY_DATABASE_URI'],
+                "pool_size": profile["read_pool_size"],
+                "max_overflow": 0
+            }
+        }
+    return profile
+
+
+class RoutingSession(Session):
+    # GET and HEAD requests read through the read pool when there is one,
+    # everything else (and any flush) goes to the write pool
+    def get_bind(self, mapper = None, clause = None, bind = None, **kwargs):
+        engines = self._db.engines
+        
+        if (bind is None) and ("read" in engines) and (not self._flushing) and has_request_context() and (request.method in ("GET", "HEAD")):
+            return engines["read"]
+        
+        return super().get_bind(mapper = mapper, clause = clause, bind = bind, **kwargs)
+
+
+db = SQLAlchemy(session_options = {"class_": RoutingSession})
+
+
+# Apply pragmas on every new pooled connection of an engine
+def apply_pragmas(engine, pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute("PRAGMA " + name + " = " + str(value))
+        cursor.close()
+    
+    db.event.listen(engine, "connect", on_connect)
+
+
+# Per request SQL statistics. The statement count is always published in the
+# X-Query-Count header, with SQL_INSTRUMENTATION on the statements are also timed,
+# published in the Server-Timing header and the slow ones written to the slow query log
+slow_query_log = logging.getLogger("slow_query")
+
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get("query_count", 0) + 1
+
+def instrument_engine(engine, threshold_ms):
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        context.query_started = time.perf_counter()
+    
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - context.query_started
+        
+        if has_request_context():
+            g.query_time = g.get("query_time", 0.0) + duration
+            slowest = g.get("slowest_query", None)
+            if (slowest is None) or (duration > slowest[0]):
+                g.slowest_query = (duration, statement)
+        
+        if duration * 1000 >= threshold_ms:
+            plan = query_plan(cursor, statement, parameters, executemany)
+            slow_query_log.warning(
+                "%.3f ms %s %s\n    plan: %s",
+                duration * 1000, " ".join(statement.split()), parameters if not executemany else "(executemany)",
+                "\n          ".join(plan)
+            )
+    
+    db.event.listen(engine, "before_cursor_execute", start_timer)
+    db.event.listen(engine, "after_cursor_execute", stop_timer)
+
+def query_plan(cursor, statement, parameters, executemany):
+    # EXPLAIN QUERY PLAN on a raw DBAPI cursor, so no engine events run again
+    if executemany:
+        parameters = parameters[0] if parameters else ()
+    try:
+        plan_cursor = cursor.connection.cursor()
+        rows = plan_cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+        plan_cursor.close()
+    except sqlite3.Error as e:
+        return ["not available: " + str(e)]
+    return [str(row[-1]) for row in rows]
+
+def reset_query_stats():
+    g.query_count = 0
+    g.query_time = 0.0
+    g.slowest_query = None
+
+def add_query_stats(response):
+    response.headers["X-Query-Count"] = str(g.get("query_count", 0))
+    
+    if current_app.config['SQL_INSTRUMENTATION']:
+        timing = 'db;dur=%.3f;desc="%d queries"' % (g.get("query_time", 0.0) * 1000, g.get("query_count", 0))
+        slowest = g.get("slowest_query", None)
+        if slowest:
+            # The header value is a quoted string, hence only a short clean prefix of the statement
+            statement = " ".join(slowest[1].replace('"', "'").replace("\\", "").split())[:80]
+            timing += ', db-slowest;dur=%.3f;desc="%s"' % (slowest[0] * 1000, statement)
+        response.headers["Server-Timing"] = timing
+    return response
+
+def configure_slow_query_log(path):
+    # One file handler per log file, even when several apps are created
+    for handler in slow_query_log.handlers:
+        if getattr(handler, "baseFilename", None) == os.path.abspath(path):
+            return
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_query_log.addHandler(handler)
+    slow_query_log.setLevel(logging.WARNING)
 
 
 # Models
@@ -31,6 +205,13 @@ class Course(db.Model):
 
 class Enrollment(db.Model):
     __tablename__ = 'enrollment'
+    # A student can be enrolled in a course only once, the unique index also serves
+    # lookups by student and the second index serves lookups by course.
+    # Existing databases get them with migrate.py
+    __table_args__ = (
+        db.Index("ux_enrollment_student_course", "student_id", "course_id", unique = True),
+        db.Index("ix_enrollment_course_student", "course_id", "student_id")
+    )
     enrollment_id = db.Column(db.Integer, primary_key = True, autoincrement = True)
     student_id = db.Column(db.Integer, db.ForeignKey("student.student_id"), nullable = False)
     course_id = db.Column(db.Integer, db.ForeignKey("course.course_id"), nullable = False)
@@ -41,406 +222,1041 @@ class NotFoundError(HTTPException):
     def __init__(self, status_code, message = ''):
         self.response = make_response(message, status_code)
 
+class PreconditionFailedError(HTTPException):
+    def __init__(self, status_code = 412, message = ''):
+        self.response = make_response(message, status_code)
+
 class BusinessValidationError(HTTPException):
     def __init__(self, status_code, error_code, error_message):
         message = {"error_code": error_code, "error_message": error_message}
-        self.response = make_response(json.dumps(message), status_code)
-
-# Output Fields in JSON Format
-course_fields = {
-    "course_id": fields.Integer,
-    "course_name": fields.String,
-    "course_code": fields.String,
-    "course_description": fields.String
-}
+        self.response = make_response(dumps(message), status_code)
 
-student_fields = {
-    "student_id": fields.Integer,
-    "first_name": fields.String,
-    "last_name": fields.String,
-    "roll_number": fields.String
-}
+# Output Fields in JSON Format, each encoder is compiled once and reads the
+# fields straight off ORM objects or result rows
+course_encoder = Encoder(("course_id", "course_name", "course_code", "course_description"))
+student_encoder = Encoder(("student_id", "first_name", "last_name", "roll_number"))
+enrollment_encoder = Encoder(("enrollment_id", "student_id", "course_id"))
+
+
+# Conditional requests
+def content_etag(body):
+    # Strong ETag from a hash of the encoded output, the encoders always
+    # write the fields in the same order
+    return hashlib.sha1(body).hexdigest()
+
+def quote_etag(etag):
+    return '"' + etag + '"'
+
+def conditional_response(body, etag, status_code = 200):
+    headers = {"ETag": quote_etag(etag)}
+    
+    # The client already has this version, hence answer without a body
+    if request.if_none_match.contains_weak(etag):
+        return "", 304, headers
+    
+    return json_response(body, status_code, headers)
+
+def check_if_match(etag):
+    if request.if_match and not request.if_match.contains(etag):
+        raise PreconditionFailedError()
+
+def unchanged_since_read(model, row, encoder):
+    # With If-Match the UPDATE is made conditional on the values the ETag was
+    # checked against, so an update committed in between makes it match no row
+    if not request.if_match:
+        return []
+    return [getattr(model, name) == getattr(row, name) for name in encoder.names]
+
+
+# Cache
+class LRUCache:
+    # Bounded cache of encoded rows keyed by id, least recently used entries
+    # are evicted first and entries older than ttl seconds are treated as missing.
+    # Every process keeps its own copy, the ttl bounds how stale another
+    # process' copy can be after a write.
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Bumped on every invalidation so that a read which started before a
+        # write can not put the old row back into the cache
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    def configure(self, max_entries, ttl):
+        with self.lock:
+            self.max_entries = max_entries
+            self.ttl = ttl
+            self.generation += 1
+            self.entries.clear()
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key, None)
+            
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key, value, generation):
+        with self.lock:
+            if generation != self.generation:
+                return
+            
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last = False)
+                self.evictions += 1
+    
+    def invalidate(self, *keys):
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.entries.pop(key, None)
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0
+            }
+
+# Sized again by create_app from the application's configuration
+course_cache = LRUCache(DEFAULT_CONFIG['COURSE_CACHE_SIZE'], DEFAULT_CONFIG['CACHE_TTL'])
+student_cache = LRUCache(DEFAULT_CONFIG['STUDENT_CACHE_SIZE'], DEFAULT_CONFIG['CACHE_TTL'])
+
+def cache_gauge(stat):
+    # Reads one statistic of every cache for the metrics endpoint
+    def collect():
+        return {
+            'cache="course"': course_cache.stats()[stat],
+            'cache="student"': student_cache.stats()[stat]
+        }
+    return collect
+
+
+# Request schemas
+# Each rule is (field, required, error_code, error_message) and the rules are checked
+# in order. A rule fails when a required value is missing or when the value is numeric.
+# Fields without an error code are only read.
+COURSE_SCHEMA = (
+    ("course_name", True, "COURSE001", "Course Name is required and should be string."),
+    ("course_code", True, "COURSE002", "Course Code is required and should be string."),
+    ("course_description", False, "COURSE003", "Course Description should be string.")
+)
+
+STUDENT_SCHEMA = (
+    ("first_name", True, "STUDENT002", "First Name is required and should be string."),
+    ("roll_number", True, "STUDENT001", "Roll Number is required and should be string."),
+    ("last_name", False, "STUDENT003", "Last Name should be string.")
+)
+
+ENROLLMENT_SCHEMA = (
+    ("course_id", False, None, None),
+)
+
+
+class Validator:
+    # A schema compiled once at startup into a tuple of (field, required, error)
+    # that one tight loop runs through for every item
+    def __init__(self, schema):
+        self.fields = tuple(rule[0] for rule in schema)
+        self.rules = tuple(
+            (field, required, (error_code, error_message) if error_code else None)
+            for field, required, error_code, error_message in schema
+        )
+    
+    def validate(self, item):
+        # Returns the values read from one item and the (error_code, error_message)
+        # of the first failed rule, or None
+        if not isinstance(item, (dict, MultiDict)):
+            item = {}
+        
+        values = {}
+        error = None
+        for field, required, failure in self.rules:
+            value = item.get(field)
+            if (value is not None) and (value.__class__ is not str):
+                # Values are read as strings, same as the request parsers did
+                value = str(value)
+            values[field] = value
+            
+            if (error is None) and (failure is not None):
+                if value is None:
+                    if required:
+                        error = failure
+                elif value.isnumeric():
+                    error = failure
+        return values, error
+    
+    def validate_many(self, items):
+        # For the batch endpoints, one (values, error) per item of the JSON array
+        validate = self.validate
+        return [validate(item) for item in items]
+
+course_validator = Validator(COURSE_SCHEMA)
+student_validator = Validator(STUDENT_SCHEMA)
+enrollment_validator = Validator(ENROLLMENT_SCHEMA)
+
+
+def request_body():
+    # The JSON object when one was sent, otherwise the form and query string values
+    body = request.get_json(silent = True)
+    if isinstance(body, dict):
+        return body
+    return request.values
+
+def raise_validation_error(error):
+    raise BusinessValidationError(
+        status_code= 400,
+        error_code= error[0],
+        error_message= error[1]
+    )
 
 
-# Create Parsers to handle data in request body
-update_course_parser = reqparse.RequestParser()
-update_course_parser.add_argument("course_name")
-update_course_parser.add_argument("course_code")
-update_course_parser.add_argument("course_description")
+# Largest value of an SQLite INTEGER, bigger query parameters overflow in the driver
+MAX_INTEGER = (1 << 63) - 1
 
-create_course_parser = reqparse.RequestParser()
-create_course_parser.add_argument("course_name")
-create_course_parser.add_argument("course_code")
-create_course_parser.add_argument("course_description")
+def parse_integer(value, minimum):
+    # The integer in value, None when it is not one between minimum and MAX_INTEGER
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    if number < minimum or number > MAX_INTEGER:
+        return None
+    return number
 
-update_student_parser = reqparse.RequestParser()
-update_student_parser.add_argument("first_name")
-update_student_parser.add_argument("last_name")
-update_student_parser.add_argument("roll_number")
+def parse_cursor(after):
+    cursor = parse_integer(after, 0)
+    if cursor is None:
+        raise BusinessValidationError(
+            status_code= 400,
+            error_code= "PAGE002",
+            error_message= "Cursor should be a non negative integer."
+        )
+    return cursor
+
+
+# Keyset pagination for the collection endpoints
+def keyset_page(model, key, encoder):
+    # Read the page size, cursor and projection from the query string
+    limit = parse_integer(request.args.get("limit", current_app.config['API_PAGE_SIZE']), 1)
+    after = parse_cursor(request.args.get("after", 0))
+    selected = request.args.get("fields", None)
+    
+    if limit is None:
+        raise BusinessValidationError(
+            status_code= 400,
+            error_code= "PAGE001",
+            error_message= "Limit should be a positive integer."
+        )
+    
+    if selected:
+        names = [name.strip() for name in selected.split(",") if name.strip()]
+    else:
+        names = list(encoder.names)
+    
+    if not names:
+        raise BusinessValidationError(
+            status_code= 400,
+            error_code= "PAGE003",
+            error_message= "Fields should name at least one field."
+        )
+    
+    for name in names:
+        if name not in encoder.names:
+            raise BusinessValidationError(
+                status_code= 400,
+                error_code= "PAGE003",
+                error_message= "Unknown field " + name + "."
+            )
+    
+    limit = min(limit, current_app.config['API_MAX_PAGE_SIZE'])
+    encode = encoder.project(names)
+    
+    # Only the requested columns are selected, the key is always needed for the next cursor
+    columns = [getattr(model, name) for name in names]
+    if key.key not in names:
+        columns.append(key)
+    
+    # Seek past the cursor on the primary key index instead of using OFFSET,
+    # one extra row is fetched to know if there is a next page.
+    # The query runs here, the rows are read from the cursor while the page is streamed
+    result = db.session.execute(db.select(*columns).where(key > after).order_by(key).limit(limit + 1))
+    next_cursor = None
+    
+    def rows():
+        nonlocal next_cursor
+        last = None
+        for index, row in enumerate(result):
+            if index == limit:
+                next_cursor = last
+                break
+            last = getattr(row, key.key)
+            yield row
+    
+    def body():
+        yield b'{"items":'
+        yield from stream_array(rows(), encode)
+        yield b',"next_cursor":' + dumps(next_cursor) + b"}"
+    
+    return json_response(body())
 
-create_student_parser = reqparse.RequestParser()
-create_student_parser.add_argument("first_name")
-create_student_parser.add_argument("last_name")
-create_student_parser.add_argument("roll_number")
 
-create_enroll_parser = reqparse.RequestParser()
-create_enroll_parser.add_argument("course_id")
+# Enrollment checks
+def check_student_and_course(student_id, course_id):
+    # Check the student and the course with one query
+    student_exists, course_exists = db.session.query(
+        db.session.query(Student.student_id).filter(Student.student_id == student_id).exists(),
+        db.session.query(Course.course_id).filter(Course.course_id == course_id).exists()
+    ).one()
+    
+    if not student_exists:
+        raise BusinessValidationError(
+            status_code= 400,
+            error_code= "ENROLLMENT002",
+            error_message= "Student does not exist"
+        )
+    
+    if not course_exists:
+        raise BusinessValidationError(
+            status_code= 400,
+            error_code= "ENROLLMENT001",
+            error_message= "Course does not exist"
+        )
+
+
+# Enrollment read path
+def student_enrollments(student_id, expand = False):
+    # One LEFT JOIN from the student gives the existence check, the enrollments
+    # and their courses, so the number of queries never grows with the enrollments
+    rows = db.session.query(
+        Student.student_id,
+        Enrollment.enrollment_id,
+        Enrollment.course_id,
+        Course.course_name,
+        Course.course_code,
+        Course.course_description
+    ).select_from(Student).outerjoin(
+        Enrollment, Enrollment.student_id == Student.student_id
+    ).outerjoin(
+        Course, Course.course_id == Enrollment.course_id
+    ).filter(
+        Student.student_id == student_id
+    ).order_by(Enrollment.enrollment_id).all()
+    
+    if rows == []:
+        raise BusinessValidationError(
+            status_code= 400,
+            error_code= "ENROLLMENT002",
+            error_message= "Student does not exist"
+        )
+    
+    l = []
+    
+    for row in rows:
+        if row.enrollment_id is None:
+            # Student without any enrollment
+            continue
+        
+        msg = {
+            "enrollment_id": row.enrollment_id,
+            "student_id": row.student_id,
+            "course_id": row.course_id
+        }
+        if expand:
+            msg["course"] = course_encoder(row)
+        l.append(msg)
+    
+    return l
 
 
 # API Classes
 class CourseAPI(Resource):
-    @marshal_with(course_fields)
-    def get(self, course_id):        
+    def get(self, course_id = None):
+        if course_id is None:
+            # No id given, hence return one page of the course collection
+            return keyset_page(Course, Course.course_id, course_encoder)
+        
+        # Serve the course from the cache when it was read recently
+        cached = course_cache.get(course_id)
+        if cached is not None:
+            return conditional_response(*cached)
+        
         # Get the course details from the database
+        generation = course_cache.generation
         course = Course.query.filter(Course.course_id == course_id).scalar()
         
         if course:
-            # course exists in database, hence return the course object which will be marshalled to json
-            return course
+            # course exists in database, hence return the course object encoded to json.
+            # The cache keeps the encoded body, so a hit does no encoding at all
+            body = dumps(course_encoder(course))
+            etag = content_etag(body)
+            course_cache.set(course_id, (body, etag), generation)
+            return conditional_response(body, etag)
         else:
             # Return 404 Error
             raise NotFoundError(status_code = 404)
     
-    @marshal_with(course_fields)
     def put(self, course_id): # Update        
         course = Course.query.filter(Course.course_id == course_id).scalar()
         
         if course is None:
             raise NotFoundError(status_code= 404)
         
+        # Refuse the update when the client's copy is out of date
+        check_if_match(content_etag(dumps(course_encoder(course))))
+        
         # Get the data from request body
-        args = update_course_parser.parse_args()
-        course_name = args.get("course_name", None)
-        course_code = args.get("course_code", None)
-        course_description = args.get("course_description", None)
+        values, error = course_validator.validate(request_body())
+        if error:
+            raise_validation_error(error)
         
-        if (course_name is None) or (course_name.isnumeric()):
-            raise BusinessValidationError(
-                status_code= 400,
-                error_code= "COURSE001",
-                error_message= "Course Name is required and should be string."                
-            )
+        updated = Course.query.filter(Course.course_id == course_id, *unchanged_since_read(Course, course, course_encoder)).update({
+            "course_name": values["course_name"],
+            "course_code": values["course_code"],
+            "course_description": values["course_description"]
+        }, synchronize_session = False)
         
-        if (course_code is None) or (course_code.isnumeric()):
-            raise BusinessValidationError(
-                status_code= 400,
-                error_code= "COURSE002",
-                error_message= "Course Code is required and should be string."                
-            )
-            
-        if (course_description is not None) and (course_description.isnumeric()):
-            raise BusinessValidationError(
-                status_code= 400,
-                error_code= "COURSE003",
-                error_message= "Course Description should be string."
-            )
-            
+        if updated == 0:
+            # Changed by a concurrent request after the If-Match check, or deleted,
+            # either way a cached copy is out of date
+            db.session.rollback()
+            course_cache.invalidate(course_id)
+            if request.if_match:
+                raise PreconditionFailedError()
+            raise NotFoundError(status_code= 404)
         
-        course.course_name = course_name
-        course.course_code = course_code
-        course.course_description = course_description
         db.session.commit()
-        return course
+        course_cache.invalidate(course_id)
+        output = course_encoder(course)
+        return output, 200, {"ETag": quote_etag(content_etag(dumps(output)))}
         
     
-    def delete(self, course_id):        
-        # check if course exists
-        course = Course.query.filter(Course.course_id == course_id).scalar()
+    def delete(self, course_id):
+        # Two set based statements in one transaction, no rows are loaded into Python
+        enrollments_deleted = Enrollment.query.filter(Enrollment.course_id == course_id).delete(synchronize_session = False)
+        courses_deleted = Course.query.filter(Course.course_id == course_id).delete(synchronize_session = False)
         
-        if course is None:
+        if courses_deleted == 0:
+            # course does not exist, hence undo and return 404 Error
+            db.session.rollback()
             raise NotFoundError(status_code= 404)
         
-        enrolls = Enrollment.query.filter(Enrollment.course_id == course_id).all()
-        
-        for enroll in enrolls:
-            db.session.delete(enroll)
-        db.session.commit()
-        
-        db.session.delete(course)
         db.session.commit()
-        return "",200
+        course_cache.invalidate(course_id)
+        return {"courses_deleted": courses_deleted, "enrollments_deleted": enrollments_deleted},200
     
-    @marshal_with(course_fields)
     def post(self):
         # Get the data from request body
-        args = create_course_parser.parse_args()
-        course_name = args.get("course_name", None)
-        course_code = args.get("course_code", None)
-        course_description = args.get("course_description", None)
+        values, error = course_validator.validate(request_body())
+        course_code = values["course_code"]
         
         course = Course.query.filter(Course.course_code == course_code).scalar()
         
         if course is not None:
             return "",409
         
-        if (course_name is None) or (course_name.isnumeric()):
-            raise BusinessValidationError(
-                status_code= 400,
-                error_code= "COURSE001",
-                error_message= "Course Name is required and should be string."                
-            )
-        
-        if (course_code is None) or (course_code.isnumeric()):
-            raise BusinessValidationError(
-                status_code= 400,
-                error_code= "COURSE002",
-                error_message= "Course Code is required and should be string."                
-            )
-            
-        if (course_description is not None) and (course_description.isnumeric()):
-            raise BusinessValidationError(
-                status_code= 400,
-                error_code= "COURSE003",
-                error_message= "Course Description should be string."
-            )
+        if error:
+            raise_validation_error(error)
             
         course = Course(
-            course_name = course_name,
+            course_name = values["course_name"],
             course_code = course_code,
-            course_description = course_description
+            course_description = values["course_description"]
         )
         
         db.session.add(course)
         db.session.commit()
         
         course = Course.query.filter(Course.course_code == course_code).one()
+        course_cache.invalidate(course.course_id)
         
-        return course,201
+        return course_encoder(course),201
         
 
 class StudentAPI(Resource):
-    @marshal_with(student_fields)
-    def get(self, student_id):        
+    def get(self, student_id = None):
+        if student_id is None:
+            # No id given, hence return one page of the student collection
+            return keyset_page(Student, Student.student_id, student_encoder)
+        
+        # Serve the student from the cache when it was read recently
+        cached = student_cache.get(student_id)
+        if cached is not None:
+            return conditional_response(*cached)
+        
         # Get the student details from the database
+        generation = student_cache.generation
         student = Student.query.filter(Student.student_id == student_id).scalar()
         
         if student:
-            # student exists in database, hence return the student object which will be marshalled to json
-            return student
+            # student exists in database, hence return the student object encoded to json.
+            # The cache keeps the encoded body, so a hit does no encoding at all
+            body = dumps(student_encoder(student))
+            etag = content_etag(body)
+            student_cache.set(student_id, (body, etag), generation)
+            return conditional_response(body, etag)
         else:
             # Return 404 Error
             raise NotFoundError(status_code = 404)
     
-    @marshal_with(student_fields)
     def put(self, student_id): # Update        
         student = Student.query.filter(Student.student_id == student_id).scalar()
         
         if student is None:
             raise NotFoundError(status_code= 404)
         
+        # Refuse the update when the client's copy is out of date
+        check_if_match(content_etag(dumps(student_encoder(student))))
+        
         # Get the data from request body
-        args = update_student_parser.parse_args()
-        first_name = args.get("first_name", None)
-        last_name = args.get("last_name", None)
-        roll_number = args.get("roll_number", None)
+        values, error = student_validator.validate(request_body())
+        if error:
+            raise_validation_error(error)
         
-        if (first_name is None) or (first_name.isnumeric()):
-            raise BusinessValidationError(
-                status_code= 400,
-                error_code= "STUDENT002",
-                error_message= "First Name is required and should be string."                
-            )
+        updated = Student.query.filter(Student.student_id == student_id, *unchanged_since_read(Student, student, student_encoder)).update({
+            "first_name": values["first_name"],
+            "last_name": values["last_name"],
+            "roll_number": values["roll_number"]
+        }, synchronize_session = False)
         
-        if (roll_number is None) or (roll_number.isnumeric()):
-            raise BusinessValidationError(
-                status_code= 400,
-                error_code= "STUDENT001",
-                error_message= "Roll Number is required and should be string."                
-            )
-            
-        if (last_name is not None) and (last_name.isnumeric()):
-            raise BusinessValidationError(
-                status_code= 400,
-                error_code= "STUDENT003",
-                error_message= "Last Name should be string."
-            )
-            
+        if updated == 0:
+            # Changed by a concurrent request after the If-Match check, or deleted,
+            # either way a cached copy is out of date
+            db.session.rollback()
+            student_cache.invalidate(student_id)
+            if request.if_match:
+                raise PreconditionFailedError()
+            raise NotFoundError(status_code= 404)
         
-        student.first_name = first_name
-        student.last_name = last_name
-        student.roll_number = roll_number
         db.session.commit()
-        return student
+        student_cache.invalidate(student_id)
+        output = student_encoder(student)
+        return output, 200, {"ETag": quote_etag(content_etag(dumps(output)))}
         
     
-    def delete(self, student_id):        
-        # check if student exists
-        student = Student.query.filter(Student.student_id == student_id).scalar()
+    def delete(self, student_id):
+        # Two set based statements in one transaction, no rows are loaded into Python
+        enrollments_deleted = Enrollment.query.filter(Enrollment.student_id == student_id).delete(synchronize_session = False)
+        students_deleted = Student.query.filter(Student.student_id == student_id).delete(synchronize_session = False)
         
-        if student is None:
+        if students_deleted == 0:
+            # student does not exist, hence undo and return 404 Error
+            db.session.rollback()
             raise NotFoundError(status_code= 404)
         
-        enrolls = Enrollment.query.filter(Enrollment.student_id == student_id).all()
-        
-        for enroll in enrolls:
-            db.session.delete(enroll)
-        db.session.commit()
-        
-        db.session.delete(student)
         db.session.commit()
-        return "",200
+        student_cache.invalidate(student_id)
+        return {"students_deleted": students_deleted, "enrollments_deleted": enrollments_deleted},200
     
-    @marshal_with(student_fields)
     def post(self):
         # Get the data from request body
-        args = update_student_parser.parse_args()
-        first_name = args.get("first_name", None)
-        last_name = args.get("last_name", None)
-        roll_number = args.get("roll_number", None)
+        values, error = student_validator.validate(request_body())
+        roll_number = values["roll_number"]
         
         student = Student.query.filter(Student.roll_number == roll_number).scalar()
         
         if student is not None:
             return "",409
         
-        if (first_name is None) or (first_name.isnumeric()):
-            raise BusinessValidationError(
-                status_code= 400,
-                error_code= "STUDENT002",
-                error_message= "First Name is required and should be string."                
-            )
-        
-        if (roll_number is None) or (roll_number.isnumeric()):
-            raise BusinessValidationError(
-                status_code= 400,
-                error_code= "STUDENT001",
-                error_message= "Roll Number is required and should be string."                
-            )
-            
-        if (last_name is not None) and (last_name.isnumeric()):
-            raise BusinessValidationError(
-                status_code= 400,
-                error_code= "STUDENT003",
-                error_message= "Last Name should be string."
-            )
+        if error:
+            raise_validation_error(error)
             
         student = Student(
-            first_name = first_name,
-            last_name = last_name,
+            first_name = values["first_name"],
+            last_name = values["last_name"],
             roll_number = roll_number
         )
         
         db.session.add(student)
         db.session.commit()
         
-        student = Student.query.filter(Student.roll_number == roll_number).one()        
-        return student,201
+        student = Student.query.filter(Student.roll_number == roll_number).one()
+        student_cache.invalidate(student.student_id)        
+        return student_encoder(student),201
 
 class EnrollmentAPI(Resource):
     def get(self,student_id):
-        student = Student.query.filter(Student.student_id == student_id).scalar()
-        
-        if student is None:
-            raise BusinessValidationError(
-                status_code= 400,
-                error_code= "ENROLLMENT002",
-                error_message= "Student does not exist"
-            )
-        enrolls = Enrollment.query.filter(Enrollment.student_id == student_id).all()
+        expand = request.args.get("expand", None) == "course"
+        l = student_enrollments(student_id, expand)
         
-        if enrolls == []:
+        if l == []:
             raise NotFoundError(status_code= 404)
-        
-        l = []
-        
-        for enroll in enrolls:
-            msg = {
-                "enrollment_id": enroll.enrollment_id,
-                "student_id": enroll.student_id,
-                "course_id": enroll.course_id
-            }
-            l.append(msg)
             
-        return l,200
+        body = dumps(l)
+        return conditional_response(body, content_etag(body))
     
     def post(self, student_id):
-        args = create_enroll_parser.parse_args()
-        course_id = args.get("course_id", None)
+        values = enrollment_validator.validate(request_body())[0]
+        course_id = values["course_id"]
         
-        student = Student.query.filter(Student.student_id == student_id).scalar()
-        
-        if student is None:
-            raise BusinessValidationError(
-                status_code= 400,
-                error_code= "ENROLLMENT002",
-                error_message= "Student does not exist"
-            )
+        check_student_and_course(student_id, course_id)
             
-        course = Course.query.filter(Course.course_id == course_id).scalar()
+        # Enrolling twice is a no-op thanks to the unique (student_id, course_id) index
+        result = db.session.execute(
+            sqlite_insert(Enrollment).values(
+                student_id = student_id,
+                course_id = course_id
+            ).on_conflict_do_nothing(index_elements = ["student_id", "course_id"])
+        )
+        db.session.commit()
         
-        if course is None:
-            raise BusinessValidationError(
-                status_code= 400,
-                error_code= "ENROLLMENT001",
-                error_message= "Course does not exist"
-            )
+        expand = request.args.get("expand", None) == "course"
+        l = student_enrollments(student_id, expand)
             
-        enroll = Enrollment(
-            student_id = student_id,
-            course_id = course_id
+        return l,(201 if result.rowcount else 200)
+    
+    def delete(self, course_id, student_id):
+        # One indexed DELETE for exactly this (student, course) pair
+        deleted = Enrollment.query.filter(
+            Enrollment.student_id == student_id,
+            Enrollment.course_id == course_id
+        ).delete(synchronize_session = False)
+        
+        if deleted == 0:
+            # Nothing was deleted, find out why
+            db.session.rollback()
+            check_student_and_course(student_id, course_id)
+            raise NotFoundError(status_code= 404)
+        
+        db.session.commit()
+        
+        return "",200
+        
+
+
+# Batch helpers
+def batch_items():
+    # The request body should be a JSON array of items
+    items = request.get_json(silent = True)
+    
+    if (not isinstance(items, list)) or (items == []) or (len(items) > current_app.config['API_MAX_BATCH_SIZE']):
+        raise BusinessValidationError(
+            status_code= 400,
+            error_code= "BATCH001",
+            error_message= "Request body should be a non empty JSON array of at most " + str(current_app.config['API_MAX_BATCH_SIZE']) + " items."
         )
+    return items
+
+def item_id(value):
+    # A positive id given as a JSON number or a string, None for anything else
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        return None
+    return parse_integer(value, 1)
+
+def chunks(values, size = 500):
+    # Split large IN lists so that SQLite's bound variable limit is never reached
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+def lookup(key_column, value_column, keys):
+    # Map each key found in the database to its value with one query per chunk
+    found = {}
+    for chunk in chunks(set(keys)):
+        for key, value in db.session.query(key_column, value_column).filter(key_column.in_(chunk)):
+            found[key] = value
+    return found
+
+def item_failure(index, status_code, error = None):
+    failure = {"index": index, "status_code": status_code}
+    if error:
+        failure["error_code"] = error[0]
+        failure["error_message"] = error[1]
+    return failure
+
+
+class EntityBatchAPI(Resource):
+    # Set by the subclasses
+    model = None
+    key = None
+    unique = None
+    encoder = None
+    validator = None
+    cache = None
+    
+    def read_values(self, items):
+        # Validate every item and collect the failures instead of stopping at the first one
+        values = []
+        failures = []
         
-        db.session.add(enroll)
+        for index, (row, error) in enumerate(self.validator.validate_many(items)):
+            if error:
+                failures.append(item_failure(index, 400, error))
+            values.append(row)
+        return values, failures
+    
+    def post(self):
+        items = batch_items()
+        values, failures = self.read_values(items)
+        
+        unique = getattr(self.model, self.unique)
+        existing = lookup(unique, unique, [row[self.unique] for row in values])
+        # An item that failed validation is reported once, with its validation error
+        invalid = set(failure["index"] for failure in failures)
+        seen = set()
+        
+        for index, row in enumerate(values):
+            if index in invalid:
+                continue
+            if (row[self.unique] in existing) or (row[self.unique] in seen):
+                failures.append(item_failure(index, 409))
+            seen.add(row[self.unique])
+        
+        if failures:
+            return {"errors": sorted(failures, key = lambda failure: failure["index"])}, 400
+        
+        # One multi row INSERT ... RETURNING per chunk, all in one transaction.
+        # Plain columns are returned so that no ORM objects are reloaded after the commit
+        returned = [getattr(self.model, name) for name in self.encoder.names]
+        created = db.session.execute(
+            db.insert(self.model).returning(*returned, sort_by_parameter_order = True),
+            values
+        ).all()
         db.session.commit()
+        self.cache.invalidate(*[getattr(row, self.key) for row in created])
         
-        enrolls = Enrollment.query.filter(Enrollment.student_id == student_id).all()
+        # Up to API_MAX_BATCH_SIZE items, hence streamed instead of encoded in one piece
+        def body():
+            yield b'{"count":' + dumps(len(created)) + b',"items":'
+            yield from stream_array(created, self.encoder)
+            yield b"}"
         
-        if enrolls == []:
-            raise NotFoundError(status_code= 404)
+        return json_response(body(), 201)
+    
+    def put(self):
+        items = batch_items()
+        values, failures = self.read_values(items)
         
-        l = []
+        for index, item in enumerate(items):
+            values[index][self.key] = item_id(item.get(self.key, None) if isinstance(item, dict) else None)
         
-        for enroll in enrolls:
-            msg = {
-                "enrollment_id": enroll.enrollment_id,
-                "student_id": enroll.student_id,
-                "course_id": enroll.course_id
-            }
-            l.append(msg)
-            
-        return l,201
+        key = getattr(self.model, self.key)
+        unique = getattr(self.model, self.unique)
+        existing = lookup(key, key, [row[self.key] for row in values if row[self.key] is not None])
+        owners = lookup(unique, key, [row[self.unique] for row in values])
+        invalid = set(failure["index"] for failure in failures)
+        seen = set()
+        seen_keys = set()
+        
+        for index, row in enumerate(values):
+            if index in invalid:
+                continue
+            if row[self.key] not in existing:
+                failures.append(item_failure(index, 404))
+            elif (row[self.key] in seen_keys) or (owners.get(row[self.unique], row[self.key]) != row[self.key]) or (row[self.unique] in seen):
+                # The same row twice in one batch would let the last item silently win
+                failures.append(item_failure(index, 409))
+            seen.add(row[self.unique])
+            seen_keys.add(row[self.key])
+        
+        if failures:
+            return {"errors": sorted(failures, key = lambda failure: failure["index"])}, 400
+        
+        # Bulk UPDATE by primary key, executed as one executemany
+        db.session.execute(db.update(self.model), values)
+        db.session.commit()
+        self.cache.invalidate(*[row[self.key] for row in values])
+        
+        return {"count": len(values)}, 200
     
-    def delete(self, course_id, student_id):
-        student = Student.query.filter(Student.student_id == student_id).scalar()
+    def delete(self):
+        items = batch_items()
+        ids = [item_id(item) for item in items]
         
-        if student is None:
-            raise BusinessValidationError(
-                status_code= 400,
-                error_code= "ENROLLMENT002",
-                error_message= "Student does not exist"
-            )
-            
-        course = Course.query.filter(Course.course_id == course_id).scalar()
+        key = getattr(self.model, self.key)
+        existing = lookup(key, key, [i for i in ids if i is not None])
+        failures = [item_failure(index, 404) for index, i in enumerate(ids) if i not in existing]
         
-        if course is None:
+        if failures:
+            return {"errors": failures}, 400
+        
+        # Remove the enrollments first, then the rows themselves, in one transaction
+        enrollment_key = getattr(Enrollment, self.key)
+        for chunk in chunks(set(ids)):
+            db.session.execute(db.delete(Enrollment).where(enrollment_key.in_(chunk)))
+            db.session.execute(db.delete(self.model).where(key.in_(chunk)))
+        db.session.commit()
+        self.cache.invalidate(*existing)
+        
+        return {"count": len(existing)}, 200
+
+
+class CourseBatchAPI(EntityBatchAPI):
+    model = Course
+    key = "course_id"
+    unique = "course_code"
+    encoder = course_encoder
+    validator = course_validator
+    cache = course_cache
+
+class StudentBatchAPI(EntityBatchAPI):
+    model = Student
+    key = "student_id"
+    unique = "roll_number"
+    encoder = student_encoder
+    validator = student_validator
+    cache = student_cache
+
+class EnrollmentBatchAPI(Resource):
+    def read_pairs(self, items):
+        pairs = []
+        for item in items:
+            if isinstance(item, dict):
+                pairs.append((item_id(item.get("student_id", None)), item_id(item.get("course_id", None))))
+            else:
+                pairs.append((None, None))
+        return pairs
+    
+    def check_pairs(self, pairs):
+        # Every student and course is looked up once for the whole batch
+        students = lookup(Student.student_id, Student.student_id, [s for s, c in pairs if s is not None])
+        courses = lookup(Course.course_id, Course.course_id, [c for s, c in pairs if c is not None])
+        failures = []
+        
+        for index, (student_id, course_id) in enumerate(pairs):
+            if student_id not in students:
+                failures.append(item_failure(index, 400, ("ENROLLMENT002", "Student does not exist")))
+            elif course_id not in courses:
+                failures.append(item_failure(index, 400, ("ENROLLMENT001", "Course does not exist")))
+        return failures
+    
+    def post(self):
+        pairs = self.read_pairs(batch_items())
+        failures = self.check_pairs(pairs)
+        
+        if failures:
+            return {"errors": failures}, 400
+        
+        # Pairs that are already enrolled are skipped by the unique index
+        result = db.session.execute(
+            sqlite_insert(Enrollment.__table__).on_conflict_do_nothing(index_elements = ["student_id", "course_id"]),
+            [{"student_id": student_id, "course_id": course_id} for student_id, course_id in set(pairs)]
+        )
+        db.session.commit()
+        
+        return {"count": result.rowcount}, 201
+    
+    def delete(self):
+        pairs = self.read_pairs(batch_items())
+        failures = self.check_pairs(pairs)
+        
+        if failures:
+            return {"errors": failures}, 400
+        
+        pair = db.tuple_(Enrollment.student_id, Enrollment.course_id)
+        count = 0
+        for chunk in chunks(set(pairs), 250):
+            count += db.session.execute(db.delete(Enrollment).where(pair.in_(chunk))).rowcount
+        db.session.commit()
+        
+        return {"count": count}, 200
+
+
+class CacheStatsAPI(Resource):
+    def get(self):
+        return {
+            "course": course_cache.stats(),
+            "student": student_cache.stats()
+        },200
+
+
+
+# Export
+# Every export is ordered by the primary key and every row carries it, so a
+# client that lost the connection resumes with ?after=<last id it received>
+EXPORTS = {
+    "courses": (Course, "course_id", course_encoder),
+    "students": (Student, "student_id", student_encoder),
+    "enrollments": (Enrollment, "enrollment_id", enrollment_encoder)
+}
+
+def ndjson_chunks(result, encoder):
+    # One JSON object per line, one chunk per batch of rows
+    for rows in result.partitions():
+        yield b"".join([dumps(encoder(row)) + b"\n" for row in rows])
+
+def csv_chunks(result, encoder):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(encoder.names)
+    for rows in result.partitions():
+        # The columns are selected in the order of the header
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+def gzip_chunks(chunks):
+    # wbits 31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+class ExportAPI(Resource):
+    def get(self, entity):
+        model, key, encoder = EXPORTS[entity]
+        export_format = request.args.get("format", "ndjson")
+        
+        if export_format not in ("ndjson", "csv"):
             raise BusinessValidationError(
                 status_code= 400,
-                error_code= "ENROLLMENT001",
-                error_message= "Course does not exist"
+                error_code= "EXPORT001",
+                error_message= "Format should be ndjson or csv."
             )
-            
-        enrolls = Enrollment.query.filter(
-            Enrollment.student_id == student_id and Enrollment.course_id == course_id
-        ).all()
         
-        if enrolls == []:
-            raise NotFoundError(status_code= 404)
+        after = parse_cursor(request.args.get("after", 0))
         
-        for enroll in enrolls:
-            db.session.delete(enroll)
-        db.session.commit()
+        # yield_per streams the rows from the cursor in batches, memory does not
+        # grow with the table. The query runs here, the rows are read while the
+        # response is sent
+        key_column = getattr(model, key)
+        columns = [getattr(model, name) for name in encoder.names]
+        result = db.session.execute(
+            db.select(*columns).where(key_column > after).order_by(key_column).execution_options(yield_per = current_app.config['EXPORT_BATCH_SIZE'])
+        )
         
-        return "",200
+        if export_format == "ndjson":
+            chunks = ndjson_chunks(result, encoder)
+            mimetype = "application/x-ndjson"
+        else:
+            chunks = csv_chunks(result, encoder)
+            mimetype = "text/csv"
+        
+        headers = {
+            "Content-Disposition": "attachment; filename=" + entity + "." + export_format,
+            "Vary": "Accept-Encoding"
+        }
+        
+        # Compressed only when the client accepts it
+        if request.accept_encodings["gzip"]:
+            chunks = gzip_chunks(chunks)
+            headers["Content-Encoding"] = "gzip"
         
+        return Response(stream_with_context(chunks), headers = headers, mimetype = mimetype)
 
 
-# Adding the resources to the API
-api.add_resource(CourseAPI, "/api/course", "/api/course/<int:course_id>")
-api.add_resource(StudentAPI, "/api/student", "/api/student/<int:student_id>")
-api.add_resource(EnrollmentAPI, "/api/student/<int:student_id>/course", "/api/student/<int:student_id>/course/<int:course_id>")
+# Application factory, importing this module has no side effects
+def create_app(config = None):
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config['STORAGE_PROFILE'] = os.environ.get('STORAGE_PROFILE', app.config['STORAGE_PROFILE'])
+    if 'SQL_INSTRUMENTATION' in os.environ:
+        app.config['SQL_INSTRUMENTATION'] = os.environ['SQL_INSTRUMENTATION'] == '1'
+    if config:
+        app.config.update(config)
+    
+    profile = configure_storage(app)
+    db.init_app(app)
+    
+    with app.app_context():
+        for bind_key, engine in db.engines.items():
+            apply_pragmas(engine, profile["pragmas"])
+            if bind_key == "read":
+                # Connections of the read pool can never write
+                apply_pragmas(engine, {"query_only": "ON"})
+            db.event.listen(engine, "before_cursor_execute", count_query)
+            if app.config['SQL_INSTRUMENTATION']:
+                instrument_engine(engine, app.config['SLOW_QUERY_THRESHOLD_MS'])
+    
+    if app.config['SQL_INSTRUMENTATION'] and app.config['SLOW_QUERY_LOG']:
+        configure_slow_query_log(app.config['SLOW_QUERY_LOG'])
+    
+    app.before_request(reset_query_stats)
+    app.after_request(add_query_stats)
+    
+    # Runtime metrics at /metrics
+    metrics = Metrics(app)
+    metrics.gauge("db_pool_connections", "Connections of each pool, by state.", pool_gauges(lambda: db.engines))
+    metrics.gauge("cache_hit_ratio", "Hit ratio of the read-through caches.", cache_gauge("hit_ratio"))
+    metrics.gauge("cache_entries", "Entries held by the read-through caches.", cache_gauge("entries"))
+    
+    course_cache.configure(app.config['COURSE_CACHE_SIZE'], app.config['CACHE_TTL'])
+    student_cache.configure(app.config['STUDENT_CACHE_SIZE'], app.config['CACHE_TTL'])
+    
+    # Adding the resources to the API
+    api = Api(app)
+    api.representations["application/json"] = output_json
+    api.add_resource(CourseAPI, "/api/course", "/api/course/<int:course_id>")
+    api.add_resource(StudentAPI, "/api/student", "/api/student/<int:student_id>")
+    api.add_resource(EnrollmentAPI, "/api/student/<int:student_id>/course", "/api/student/<int:student_id>/course/<int:course_id>")
+    api.add_resource(CourseBatchAPI, "/api/course:batch")
+    api.add_resource(StudentBatchAPI, "/api/student:batch")
+    api.add_resource(EnrollmentBatchAPI, "/api/enrollment:batch")
+    api.add_resource(CacheStatsAPI, "/api/cache/stats")
+    api.add_resource(ExportAPI, "/api/export/<any(students, courses, enrollments):entity>")
+    
+    return app
+
+
+# ASGI mode
+def serve_asgi(host, port, workers, threads, keep_alive):
+    # uvicorn and a2wsgi are only needed for this mode
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("The ASGI mode needs uvicorn and a2wsgi: pip install uvicorn a2wsgi")
+    
+    # Read by asgi.py in every worker process
+    os.environ["ASGI_THREADS"] = str(threads)
+    # Several processes share the database file, hence WAL and busy_timeout by default
+    os.environ.setdefault("STORAGE_PROFILE", "production")
+    
+    uvicorn.run(
+        "asgi:application",
+        host= host,
+        port= port,
+        workers= workers,
+        timeout_keep_alive= keep_alive
+    )
 
 
-app.run(
-    debug= True,
-    port= 5000
-)
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Run the student and course API.")
+    parser.add_argument("--asgi", action = "store_true", help = "serve with uvicorn instead of the Flask development server")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 5000)
+    parser.add_argument("--workers", type = int, default = 1, help = "worker processes in ASGI mode")
+    parser.add_argument("--threads", type = int, default = 10, help = "request threads per worker in ASGI mode")
+    parser.add_argument("--keep-alive", type = int, default = 5, help = "seconds an idle keep-alive connection stays open in ASGI mode")
+    args = parser.parse_args()
+    
+    if args.asgi:
+        serve_asgi(args.host, args.port, args.workers, args.threads, args.keep_alive)
+    else:
+        create_app().run(
+            debug= True,
+            host= args.host,
+            port= args.port
+        )
@@ -0,0 +1,11 @@
+import os
+
+from a2wsgi import WSGIMiddleware
+
+from app import create_app
+
+# ASGI entry point for uvicorn, started by "python app.py --asgi" or directly with
+#     uvicorn asgi:application --workers 4
+# Each request runs the Flask app on a pool of ASGI_THREADS threads per worker,
+# so blocking SQLite calls never stall the event loop that serves keep-alive connections
+application = WSGIMiddleware(create_app(), workers = int(os.environ.get("ASGI_THREADS", "10")))
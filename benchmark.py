@@ -0,0 +1,308 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from app import create_app, db, Student, Course, Enrollment, course_validator, request_body
+
+
+# Mixed workload: (operation, weight), the writes are the last three
+OPERATIONS = [
+    ("get_course", 25),
+    ("get_student", 25),
+    ("list_students", 10),
+    ("get_enrollments", 20),
+    ("enroll", 10),
+    ("update_student", 5),
+    ("create_student", 5)
+]
+
+
+# Synthetic dataset
+def seed(app, students, courses, enrollments_per_student, seed_value):
+    rng = random.Random(seed_value)
+
+    with app.app_context():
+        db.create_all()
+        db.session.execute(
+            db.insert(Course.__table__),
+            [
+                {"course_id": i, "course_code": "CSE" + str(i), "course_name": "Course " + str(i), "course_description": "Synthetic course " + str(i)}
+                for i in range(1, courses + 1)
+            ]
+        )
+        db.session.execute(
+            db.insert(Student.__table__),
+            [
+                {"student_id": i, "roll_number": "R" + str(i), "first_name": "First" + str(i), "last_name": "Last" + str(i)}
+                for i in range(1, students + 1)
+            ]
+        )
+        per_student = min(enrollments_per_student, courses)
+        db.session.execute(
+            db.insert(Enrollment.__table__),
+            [
+                {"student_id": student_id, "course_id": course_id}
+                for student_id in range(1, students + 1)
+                for course_id in rng.sample(range(1, courses + 1), per_student)
+            ]
+        )
+        db.session.commit()
+
+
+def plan(count, students, courses, seed_value):
+    # The same list of (operation, method, path, body) is replayed against every target
+    rng = random.Random(seed_value)
+    names = [name for name, weight in OPERATIONS]
+    weights = [weight for name, weight in OPERATIONS]
+    requests = []
+
+    for i in range(count):
+        name = rng.choices(names, weights)[0]
+        student_id = rng.randint(1, students)
+        course_id = rng.randint(1, courses)
+
+        if name == "get_course":
+            requests.append((name, "GET", "/api/course/" + str(course_id), None))
+        elif name == "get_student":
+            requests.append((name, "GET", "/api/student/" + str(student_id), None))
+        elif name == "list_students":
+            requests.append((name, "GET", "/api/student?limit=100&after=" + str(rng.randint(0, students)), None))
+        elif name == "get_enrollments":
+            requests.append((name, "GET", "/api/student/" + str(student_id) + "/course?expand=course", None))
+        elif name == "enroll":
+            requests.append((name, "POST", "/api/student/" + str(student_id) + "/course", {"course_id": course_id}))
+        elif name == "update_student":
+            body = {"first_name": "Updated" + str(i), "last_name": "Last" + str(student_id), "roll_number": "R" + str(student_id)}
+            requests.append((name, "PUT", "/api/student/" + str(student_id), body))
+        else:
+            body = {"first_name": "New" + str(i), "last_name": "Student", "roll_number": "NEW" + str(seed_value) + "_" + str(i)}
+            requests.append((name, "POST", "/api/student", body))
+    return requests
+
+
+# Measurements
+def percentile(ordered, fraction):
+    if ordered == []:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(samples, seconds):
+    # samples: (operation, status_code, latency in seconds, query count)
+    latencies = sorted(latency for name, status, latency, queries in samples)
+    queries = [count for name, status, latency, count in samples if count is not None]
+    statuses = {}
+    operations = {}
+
+    for name, status, latency, count in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        operations.setdefault(name, []).append(latency)
+
+    return {
+        "requests": len(samples),
+        "seconds": round(seconds, 4),
+        "throughput_rps": round(len(samples) / seconds, 2) if seconds else None,
+        "latency_ms": latency_summary(latencies),
+        "queries_per_request": {
+            "mean": round(sum(queries) / len(queries), 3) if queries else None,
+            "max": max(queries) if queries else None
+        },
+        "status_codes": statuses,
+        "operations": {
+            name: dict(count = len(values), **latency_summary(sorted(values)))
+            for name, values in sorted(operations.items())
+        }
+    }
+
+
+def latency_summary(ordered):
+    return {
+        "p50": milliseconds(percentile(ordered, 0.50)),
+        "p95": milliseconds(percentile(ordered, 0.95)),
+        "p99": milliseconds(percentile(ordered, 0.99)),
+        "max": milliseconds(ordered[-1] if ordered else None)
+    }
+
+
+def milliseconds(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def query_count(value):
+    return int(value) if value is not None else None
+
+
+# Targets
+class KeepAliveHandler(WSGIRequestHandler):
+    # HTTP/1.1 so that the client connections are reused, and no access log
+    protocol_version = "HTTP/1.1"
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def run_test_client(app, requests):
+    client = app.test_client()
+    samples = []
+    started = time.perf_counter()
+
+    for name, method, path, body in requests:
+        begin = time.perf_counter()
+        response = client.open(path, method = method, json = body)
+        response.get_data()
+        samples.append((name, response.status_code, time.perf_counter() - begin, query_count(response.headers.get("X-Query-Count"))))
+
+    return summarize(samples, time.perf_counter() - started)
+
+
+def run_server(app, requests, concurrency):
+    # A real threaded HTTP server on a free local port, driven by keep-alive connections
+    server = make_server("127.0.0.1", 0, app, threaded = True, request_handler = KeepAliveHandler)
+    server_thread = threading.Thread(target = server.serve_forever, daemon = True)
+    server_thread.start()
+
+    samples = []
+    lock = threading.Lock()
+    shares = [requests[i::concurrency] for i in range(concurrency)]
+
+    def client(share):
+        connection = http.client.HTTPConnection("127.0.0.1", server.server_port)
+        local = []
+        for name, method, path, body in share:
+            payload = None if body is None else json.dumps(body)
+            headers = {} if body is None else {"Content-Type": "application/json"}
+            begin = time.perf_counter()
+            connection.request(method, path, body = payload, headers = headers)
+            response = connection.getresponse()
+            response.read()
+            local.append((name, response.status, time.perf_counter() - begin, query_count(response.getheader("X-Query-Count"))))
+        connection.close()
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target = client, args = (share,)) for share in shares]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    server.shutdown()
+    return summarize(samples, seconds)
+
+
+# Validation microbenchmark
+def run_validation(app, rounds):
+    # The request parser and hand written checks the course handlers used before,
+    # against the compiled course schema, on the same request body
+    from flask_restful import reqparse
+
+    parser = reqparse.RequestParser()
+    parser.add_argument("course_name")
+    parser.add_argument("course_code")
+    parser.add_argument("course_description")
+
+    def before():
+        args = parser.parse_args()
+        course_name = args.get("course_name", None)
+        course_code = args.get("course_code", None)
+        course_description = args.get("course_description", None)
+        if (course_name is None) or (course_name.isnumeric()):
+            return ("COURSE001", "Course Name is required and should be string.")
+        if (course_code is None) or (course_code.isnumeric()):
+            return ("COURSE002", "Course Code is required and should be string.")
+        if (course_description is not None) and (course_description.isnumeric()):
+            return ("COURSE003", "Course Description should be string.")
+        return None
+
+    def after():
+        return course_validator.validate(request_body())
+
+    body = {"course_name": "Modern Application Development", "course_code": "CSE01", "course_description": "Flask, SQLAlchemy and REST APIs"}
+    report = {"rounds": rounds}
+
+    with app.test_request_context("/api/course", method = "POST", json = body):
+        for name, function in (("reqparse", before), ("schema", after)):
+            function()
+            begin = time.perf_counter()
+            for i in range(rounds):
+                function()
+            report[name + "_us_per_request"] = round((time.perf_counter() - begin) / rounds * 1000000, 3)
+
+    items = [body] * 1000
+    begin = time.perf_counter()
+    for i in range(max(1, rounds // 1000)):
+        course_validator.validate_many(items)
+    report["schema_batch_us_per_item"] = round((time.perf_counter() - begin) / (max(1, rounds // 1000) * 1000) * 1000000, 3)
+    report["speedup"] = round(report["reqparse_us_per_request"] / report["schema_us_per_request"], 2)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Seed a synthetic dataset and benchmark the REST API.")
+    parser.add_argument("--students", type = int, default = 10000)
+    parser.add_argument("--courses", type = int, default = 200)
+    parser.add_argument("--enrollments-per-student", type = int, default = 5)
+    parser.add_argument("--requests", type = int, default = 5000, help = "requests replayed against each target")
+    parser.add_argument("--concurrency", type = int, default = 8, help = "keep-alive connections against the local server")
+    parser.add_argument("--storage-profile", default = "production", choices = ["development", "production"])
+    parser.add_argument("--targets", default = "test_client,server", help = "comma separated: test_client, server, validation")
+    parser.add_argument("--validation-rounds", type = int, default = 100000)
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--output", help = "write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix = "api-benchmark-")
+    try:
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(directory, "benchmark.sqlite3"),
+            "STORAGE_PROFILE": args.storage_profile
+        })
+        begin = time.perf_counter()
+        seed(app, args.students, args.courses, args.enrollments_per_student, args.seed)
+        seed_seconds = time.perf_counter() - begin
+
+        report = {
+            "dataset": {
+                "students": args.students,
+                "courses": args.courses,
+                "enrollments_per_student": min(args.enrollments_per_student, args.courses),
+                "seed_seconds": round(seed_seconds, 3)
+            },
+            "storage_profile": args.storage_profile,
+            "python": sys.version.split()[0],
+            "results": {}
+        }
+
+        # Every target gets its own copy of the plan so that the writes do not collide
+        for index, target in enumerate(args.targets.split(",")):
+            requests = plan(args.requests, args.students, args.courses, args.seed * 1000 + index)
+            if target == "test_client":
+                report["results"][target] = run_test_client(app, requests)
+            elif target == "validation":
+                report["results"][target] = run_validation(app, args.validation_rounds)
+            elif target == "server":
+                report["results"][target] = run_server(app, requests, args.concurrency)
+                report["results"][target]["concurrency"] = args.concurrency
+            else:
+                parser.error("unknown target " + target)
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+
+    output = json.dumps(report, indent = 2, sort_keys = True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
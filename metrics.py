@@ -0,0 +1,188 @@
+import bisect
+import threading
+import time
+
+from flask import request, g, Response
+
+# Prometheus style metrics for a Flask app, shared by the API and the week 4
+# and week 5 apps.
+#
+# Every thread counts into its own shard, so the request hot path never takes a
+# lock: it only does list index increments on objects no other thread writes to.
+# A scrape adds the shards together. The lock is only taken when a thread makes
+# its first shard and during a scrape. Werkzeug's threaded server starts a
+# thread per connection, hence the shards of threads that ended are added into
+# one shard at those two points and the list only grows with the live threads.
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Shard:
+    def __init__(self, thread = None):
+        # The thread counting into this shard, None for the shard of ended threads
+        self.thread = thread
+        # (route, method, status) -> [count, sum of seconds, bucket counts..., +Inf count]
+        self.requests = {}
+        self.in_flight = 0
+
+    def add(self, other):
+        self.in_flight += other.in_flight
+        # A snapshot, a live thread may add a series meanwhile
+        for key, series in list(other.requests.items()):
+            total = self.requests.get(key)
+            if total is None:
+                self.requests[key] = list(series)
+            else:
+                for i, value in enumerate(series):
+                    total[i] += value
+
+
+class Metrics:
+    def __init__(self, app = None, buckets = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.local = threading.local()
+        self.shards = []
+        # Counts of the threads that ended
+        self.ended = Shard()
+        self.lock = threading.Lock()
+        # Extra gauges added by the application: name -> (help, function returning {labels: value})
+        self.gauges = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self.start_request)
+        app.after_request(self.record_status)
+        app.teardown_request(self.end_request)
+        app.add_url_rule("/metrics", "metrics", self.scrape)
+
+    def gauge(self, name, help, collect):
+        self.gauges[name] = (help, collect)
+
+    def shard(self):
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = Shard(threading.current_thread())
+            self.local.shard = shard
+            with self.lock:
+                self.fold_ended()
+                self.shards.append(shard)
+        return shard
+
+    def fold_ended(self):
+        # With the lock held. A thread that ended writes to its shard no more
+        alive = []
+        for shard in self.shards:
+            if shard.thread.is_alive():
+                alive.append(shard)
+            else:
+                self.ended.add(shard)
+        self.shards = alive
+
+    # Hot path
+    def start_request(self):
+        g.metrics_started = time.perf_counter()
+        self.shard().in_flight += 1
+
+    def end_request(self, exception = None):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        shard = self.shard()
+        shard.in_flight -= 1
+
+        # The route rule instead of the path, so that ids do not create new series
+        rule = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        status = g.pop("metrics_status", 500 if exception is not None else 200)
+        key = (rule, request.method, status)
+
+        series = shard.requests.get(key)
+        if series is None:
+            # Pre-allocated: count, sum, one slot per bucket and +Inf
+            series = [0, 0.0] + [0] * (len(self.buckets) + 1)
+            shard.requests[key] = series
+        series[0] += 1
+        series[1] += duration
+        series[2 + bisect.bisect_left(self.buckets, duration)] += 1
+
+    def record_status(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    # Scrape
+    def collect(self):
+        total = Shard()
+        with self.lock:
+            self.fold_ended()
+            total.add(self.ended)
+            for shard in self.shards:
+                total.add(shard)
+        return total.requests, total.in_flight
+
+    def scrape(self):
+        requests, in_flight = self.collect()
+        lines = []
+
+        lines.append("# HELP http_requests_total Requests handled, by route, method and status code.")
+        lines.append("# TYPE http_requests_total counter")
+        for (rule, method, status), series in sorted(requests.items()):
+            lines.append('http_requests_total{%s} %d' % (labels(rule, method, status), series[0]))
+
+        lines.append("# HELP http_request_duration_seconds Request latency, by route, method and status code.")
+        lines.append("# TYPE http_request_duration_seconds histogram")
+        for (rule, method, status), series in sorted(requests.items()):
+            label = labels(rule, method, status)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series[2:]):
+                cumulative += count
+                lines.append('http_request_duration_seconds_bucket{%s,le="%s"} %d' % (label, repr(bound), cumulative))
+            cumulative += series[-1]
+            lines.append('http_request_duration_seconds_bucket{%s,le="+Inf"} %d' % (label, cumulative))
+            lines.append('http_request_duration_seconds_sum{%s} %.6f' % (label, series[1]))
+            lines.append('http_request_duration_seconds_count{%s} %d' % (label, series[0]))
+
+        lines.append("# HELP http_requests_in_flight Requests being handled right now.")
+        lines.append("# TYPE http_requests_in_flight gauge")
+        # Includes this scrape
+        lines.append("http_requests_in_flight %d" % in_flight)
+
+        for name, (help, collect) in sorted(self.gauges.items()):
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s gauge" % name)
+            for label, value in sorted(collect().items()):
+                if label:
+                    lines.append("%s{%s} %s" % (name, label, format_value(value)))
+                else:
+                    lines.append("%s %s" % (name, format_value(value)))
+
+        return Response("\n".join(lines) + "\n", mimetype = "text/plain; version=0.0.4")
+
+
+def labels(rule, method, status):
+    return 'route="%s",method="%s",status="%s"' % (escape(rule), method, status)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value):
+    return repr(float(value))
+
+
+def pool_gauges(engines):
+    # Connection pool usage of every engine, engines() returns {bind_key: engine}
+    def collect():
+        values = {}
+        for key, engine in engines().items():
+            pool = engine.pool
+            label = 'bind="%s"' % escape(key or "default")
+            for state, method in (("checked_out", "checkedout"), ("checked_in", "checkedin"), ("size", "size"), ("overflow", "overflow")):
+                if hasattr(pool, method):
+                    # QueuePool.overflow() counts up from -pool_size, no overflow is 0
+                    values[label + ',state="%s"' % state] = max(getattr(pool, method)(), 0)
+        return values
+    return collect
@@ -0,0 +1,127 @@
+import argparse
+import sqlite3
+import sys
+
+# Enrollment tables this migration knows about: the API in app.py and the week 5 app
+SCHEMAS = {
+    "enrollment": {
+        "student_column": "student_id",
+        "course_column": "course_id",
+        "unique_index": "ux_enrollment_student_course",
+        "course_index": "ix_enrollment_course_student"
+    },
+    "enrollments": {
+        "student_column": "estudent_id",
+        "course_column": "ecourse_id",
+        "unique_index": "ux_enrollments_student_course",
+        "course_index": "ix_enrollments_course_student"
+    }
+}
+
+# Student list indexes of the week 5 app, see its models.py
+STUDENT_INDEXES = [
+    ("ix_student_first_name", "student (first_name, student_id)"),
+    ("ix_student_last_name", "student (coalesce(last_name, ''), student_id)")
+]
+
+
+def connect(path, busy_timeout):
+    # Autocommit mode, every step below opens its own short transaction so that
+    # the application keeps writing while the migration runs
+    connection = sqlite3.connect(path, isolation_level = None)
+    connection.execute("PRAGMA busy_timeout = " + str(busy_timeout))
+    return connection
+
+
+def find_tables(connection):
+    rows = connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+    return [name for (name,) in rows if name in SCHEMAS]
+
+
+def duplicate_groups(connection, table, schema, batch_size):
+    # (student, course, enrollment id to keep) for pairs enrolled more than once
+    return connection.execute(
+        "SELECT " + schema["student_column"] + ", " + schema["course_column"] + ", MIN(enrollment_id)"
+        " FROM " + table +
+        " GROUP BY " + schema["student_column"] + ", " + schema["course_column"] +
+        " HAVING COUNT(*) > 1 LIMIT ?",
+        (batch_size,)
+    ).fetchall()
+
+
+def delete_duplicates(connection, table, schema, groups):
+    cursor = connection.executemany(
+        "DELETE FROM " + table +
+        " WHERE " + schema["student_column"] + " = ? AND " + schema["course_column"] + " = ? AND enrollment_id <> ?",
+        groups
+    )
+    return cursor.rowcount
+
+
+def migrate_table(connection, table, batch_size):
+    schema = SCHEMAS[table]
+
+    # The non unique index first, it is cheap to build and speeds up the dedup below
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS " + schema["course_index"] +
+        " ON " + table + " (" + schema["course_column"] + ", " + schema["student_column"] + ")"
+    )
+    print(table + ": index " + schema["course_index"] + " ready")
+
+    # Remove duplicates in small transactions, keeping the oldest enrollment of each pair
+    removed = 0
+    while True:
+        connection.execute("BEGIN IMMEDIATE")
+        groups = duplicate_groups(connection, table, schema, batch_size)
+        removed += delete_duplicates(connection, table, schema, groups)
+        connection.execute("COMMIT")
+
+        if len(groups) < batch_size:
+            break
+    print(table + ": removed " + str(removed) + " duplicate enrollments")
+
+    # Duplicates written since the last batch are removed in the same
+    # transaction that builds the unique index, so the build can not fail
+    connection.execute("BEGIN IMMEDIATE")
+    late = 0
+    while True:
+        groups = duplicate_groups(connection, table, schema, batch_size)
+        late += delete_duplicates(connection, table, schema, groups)
+        if len(groups) < batch_size:
+            break
+    connection.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS " + schema["unique_index"] +
+        " ON " + table + " (" + schema["student_column"] + ", " + schema["course_column"] + ")"
+    )
+    connection.execute("COMMIT")
+    print(table + ": removed " + str(late) + " late duplicates, unique index " + schema["unique_index"] + " ready")
+
+    connection.execute("ANALYZE " + table)
+
+
+def migrate_students(connection):
+    for name, definition in STUDENT_INDEXES:
+        connection.execute("CREATE INDEX IF NOT EXISTS " + name + " ON " + definition)
+        print("student: index " + name + " ready")
+    connection.execute("ANALYZE student")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Deduplicate enrollments and add their indexes on a live SQLite database.")
+    parser.add_argument("database", help = "path of the SQLite database file, e.g. instance/api_database.sqlite3")
+    parser.add_argument("--batch-size", type = int, default = 1000, help = "duplicate pairs removed per transaction")
+    parser.add_argument("--busy-timeout", type = int, default = 5000, help = "milliseconds to wait for the application's write lock")
+    args = parser.parse_args()
+
+    connection = connect(args.database, args.busy_timeout)
+    tables = find_tables(connection)
+
+    if tables == []:
+        print("No enrollment table found in " + args.database)
+        sys.exit(1)
+
+    for table in tables:
+        migrate_table(connection, table, args.batch_size)
+    if "enrollments" in tables:
+        migrate_students(connection)
+    connection.close()
@@ -0,0 +1,90 @@
+import json
+from operator import attrgetter
+
+from flask import Response, make_response, stream_with_context
+
+# JSON serialization for the API.
+#
+# orjson is used when it is installed and the standard library otherwise, both
+# produce the same bytes for the values the API returns (compact separators,
+# UTF-8 instead of \u escapes) so that ETags do not depend on the backend.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def dumps(value, sort_keys = False):
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(value, option = option)
+else:
+    BACKEND = "json"
+
+    def dumps(value, sort_keys = False):
+        return json.dumps(value, sort_keys = sort_keys, separators = (",", ":"), ensure_ascii = False).encode("utf-8")
+
+
+class Encoder:
+    # Row to dict encoder compiled once for a list of field names. It reads the
+    # fields with one attrgetter call, which works the same on ORM objects and
+    # on result rows of plain columns.
+    def __init__(self, names):
+        self.names = tuple(names)
+        if not self.names:
+            raise ValueError("an encoder needs at least one field")
+        getter = attrgetter(*self.names)
+        if len(self.names) == 1:
+            # attrgetter of a single name returns the value instead of a tuple
+            self.values = lambda row: (getter(row),)
+        else:
+            self.values = getter
+        self.projections = {}
+
+    def __call__(self, row):
+        return dict(zip(self.names, self.values(row)))
+
+    def project(self, names):
+        # Encoder for a subset of the fields, compiled on first use
+        names = tuple(dict.fromkeys(names))
+        encoder = self.projections.get(names, None)
+        if encoder is None:
+            encoder = Encoder(names)
+            self.projections[names] = encoder
+        return encoder
+
+
+def stream_array(rows, encode, chunk_size = 500):
+    # Yields a JSON array chunk by chunk, only chunk_size encoded rows are held at a time
+    yield b"["
+    separator = b""
+    chunk = []
+    for row in rows:
+        chunk.append(dumps(encode(row)))
+        if len(chunk) == chunk_size:
+            yield separator + b",".join(chunk)
+            separator = b","
+            chunk = []
+    if chunk:
+        yield separator + b",".join(chunk)
+    yield b"]"
+
+
+def json_response(body, status_code = 200, headers = None):
+    # body is either encoded bytes or an iterable of byte chunks to stream
+    if not isinstance(body, bytes):
+        body = stream_with_context(body)
+    return Response(body, status = status_code, headers = headers, mimetype = "application/json")
+
+
+def output_json(data, code, headers = None):
+    # Flask-RESTful representation for everything the resources return as plain values
+    response = make_response(dumps(data), code)
+    response.headers.extend(headers or {})
+    response.mimetype = "application/json"
+    return response
@@ -0,0 +1,333 @@
+import sqlite3
+import threading
+
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+import app as api
+from app import create_app, db, Student, Course, Enrollment
+from metrics import Metrics, pool_gauges
+from serializer import Encoder
+
+# Regression tests for the API, each test gets its own in-memory database
+#
+#   python -m pytest test_app.py
+
+
+@pytest.fixture
+def app():
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def add_students(count):
+    students = [Student(roll_number = "R" + str(i), first_name = "Student " + str(i)) for i in range(count)]
+    db.session.add_all(students)
+    db.session.commit()
+    return [student.student_id for student in students]
+
+def add_course(code = "MAD1"):
+    course = Course(course_code = code, course_name = "Modern Application Development")
+    db.session.add(course)
+    db.session.commit()
+    return course.course_id
+
+
+def test_delete_enrollment_removes_only_that_pair(client):
+    student_ids = add_students(3)
+    course_id = add_course()
+    for student_id in student_ids:
+        response = client.post("/api/student/" + str(student_id) + "/course", json = {"course_id": course_id})
+        assert response.status_code == 201
+
+    url = "/api/student/" + str(student_ids[0]) + "/course/" + str(course_id)
+    assert client.delete(url).status_code == 200
+    assert client.delete(url).status_code == 404
+
+    remaining = db.session.execute(
+        db.select(Enrollment.student_id).where(Enrollment.course_id == course_id).order_by(Enrollment.student_id)
+    ).scalars().all()
+    assert remaining == student_ids[1:]
+
+
+@pytest.mark.parametrize("query", [
+    "after=99999999999999999999999",
+    "after=9223372036854775808",
+    "after=-1",
+    "after=x",
+    "limit=%C2%BD",
+    "limit=0",
+    "limit=99999999999999999999999"
+])
+def test_collection_rejects_bad_cursor_and_limit(client, query):
+    response = client.get("/api/course?" + query)
+    assert response.status_code == 400
+    assert response.get_json(force = True)["error_code"] in ("PAGE001", "PAGE002")
+
+def test_export_rejects_out_of_range_cursor(client):
+    response = client.get("/api/export/students?after=99999999999999999999999")
+    assert response.status_code == 400
+    assert response.get_json(force = True)["error_code"] == "PAGE002"
+
+def test_collection_accepts_largest_cursor(client):
+    add_course()
+    response = client.get("/api/course?after=9223372036854775807")
+    assert response.status_code == 200
+    assert response.json == {"items": [], "next_cursor": None}
+
+
+def test_put_with_if_match_loses_no_concurrent_update(tmp_path, monkeypatch):
+    # A file database, so that a second connection can commit between the
+    # If-Match check and the UPDATE like a concurrent request would
+    path = tmp_path / "api.sqlite3"
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(path)})
+    with app.app_context():
+        db.create_all()
+        course_id = add_course()
+        client = app.test_client()
+        etag = client.get("/api/course/" + str(course_id)).headers["ETag"]
+
+        check_if_match = api.check_if_match
+        def check_then_update(current):
+            check_if_match(current)
+            with sqlite3.connect(str(path)) as connection:
+                connection.execute("UPDATE course SET course_name = 'Concurrent' WHERE course_id = ?", (course_id,))
+        monkeypatch.setattr(api, "check_if_match", check_then_update)
+
+        body = {"course_name": "Mine", "course_code": "MAD1", "course_description": ""}
+        response = client.put("/api/course/" + str(course_id), json = body, headers = {"If-Match": etag})
+        assert response.status_code == 412
+        db.session.expire_all()
+        assert db.session.get(Course, course_id).course_name == "Concurrent"
+
+        monkeypatch.setattr(api, "check_if_match", check_if_match)
+        etag = client.get("/api/course/" + str(course_id)).headers["ETag"]
+        response = client.put("/api/course/" + str(course_id), json = body, headers = {"If-Match": etag})
+        assert response.status_code == 200
+        assert response.json["course_name"] == "Mine"
+        db.session.remove()
+
+
+@pytest.mark.parametrize("fields", [",", " , ,"])
+def test_collection_rejects_empty_projection(client, fields):
+    add_course()
+    response = client.get("/api/course", query_string = {"fields": fields})
+    assert response.status_code == 400
+    assert response.get_json(force = True)["error_code"] == "PAGE003"
+
+def test_encoder_needs_a_field():
+    with pytest.raises(ValueError):
+        Encoder(())
+
+
+def test_course_batch_create_update_delete(client):
+    response = client.post("/api/course:batch", json = [
+        {"course_name": "Course A", "course_code": "A1"},
+        {"course_name": "Course B", "course_code": "B1", "course_description": "Second"}
+    ])
+    assert response.status_code == 201
+    created = response.json["items"]
+    assert response.json["count"] == 2
+    assert [course["course_code"] for course in created] == ["A1", "B1"]
+
+    ids = [course["course_id"] for course in created]
+    response = client.put("/api/course:batch", json = [
+        {"course_id": ids[0], "course_name": "Renamed", "course_code": "A1"},
+        {"course_id": str(ids[1]), "course_name": "Course B", "course_code": "B2"}
+    ])
+    assert response.status_code == 200
+    assert response.json == {"count": 2}
+    assert client.get("/api/course/" + str(ids[0])).json["course_name"] == "Renamed"
+    assert client.get("/api/course/" + str(ids[1])).json["course_code"] == "B2"
+
+    response = client.delete("/api/course:batch", json = ids)
+    assert response.status_code == 200
+    assert response.json == {"count": 2}
+    assert client.get("/api/course/" + str(ids[0])).status_code == 404
+
+def test_course_batch_reports_each_failed_item_once(client):
+    add_course("MAD1")
+    response = client.post("/api/course:batch", json = [
+        {"course_name": "Fine", "course_code": "OK1"},
+        {"course_name": "Taken", "course_code": "MAD1"},
+        {"course_code": "MAD1"},
+        {"course_name": "Twice", "course_code": "OK1"},
+        "not an object"
+    ])
+    assert response.status_code == 400
+    errors = response.json["errors"]
+    assert [(error["index"], error["status_code"]) for error in errors] == [(1, 409), (2, 400), (3, 409), (4, 400)]
+    assert errors[1]["error_code"] == "COURSE001"
+    assert Course.query.count() == 1
+
+def test_course_batch_update_refuses_the_same_course_twice(client):
+    course_id = add_course("MAD1")
+    response = client.put("/api/course:batch", json = [
+        {"course_id": course_id, "course_name": "First", "course_code": "MAD1"},
+        {"course_id": course_id, "course_name": "Second", "course_code": "MAD2"}
+    ])
+    assert response.status_code == 400
+    assert response.json["errors"] == [{"index": 1, "status_code": 409}]
+    assert db.session.get(Course, course_id).course_name == "Modern Application Development"
+
+@pytest.mark.parametrize("course_id", ["²", "99999999999999999999999", 0, -1, True, 1.5, None])
+def test_course_batch_rejects_bad_ids(client, course_id):
+    add_course("MAD1")
+    response = client.put("/api/course:batch", json = [{"course_id": course_id, "course_name": "x", "course_code": "MAD1"}])
+    assert response.status_code == 400
+    assert response.json["errors"] == [{"index": 0, "status_code": 404}]
+    response = client.delete("/api/course:batch", json = [course_id])
+    assert response.status_code == 400
+    assert response.json["errors"] == [{"index": 0, "status_code": 404}]
+
+def test_enrollment_batch_rejects_bad_ids(client):
+    student_id = add_students(1)[0]
+    response = client.post("/api/enrollment:batch", json = [{"student_id": student_id, "course_id": "99999999999999999999999"}])
+    assert response.status_code == 400
+    assert response.json["errors"][0]["error_code"] == "ENROLLMENT001"
+
+
+def cache_stats(client, entity = "course"):
+    return client.get("/api/cache/stats").json[entity]
+
+def test_single_writes_invalidate_the_cache(client):
+    course_id = add_course("MAD1")
+    url = "/api/course/" + str(course_id)
+    assert client.get(url).json["course_name"] == "Modern Application Development"
+
+    response = client.put(url, json = {"course_name": "Renamed", "course_code": "MAD1"})
+    assert response.status_code == 200
+    assert client.get(url).json["course_name"] == "Renamed"
+
+    assert client.delete(url).status_code == 200
+    assert client.get(url).status_code == 404
+
+    # SQLite hands the freed id to the next course, a cached copy of the old
+    # course under that id must not survive the POST
+    course_id = add_course("MAD2")
+    assert client.get("/api/course/" + str(course_id)).json["course_code"] == "MAD2"
+    db.session.execute(db.delete(Course).where(Course.course_id == course_id))
+    db.session.commit()
+    response = client.post("/api/course", json = {"course_name": "New", "course_code": "MAD3"})
+    assert response.status_code == 201
+    assert response.json["course_id"] == course_id
+    assert client.get("/api/course/" + str(course_id)).json["course_code"] == "MAD3"
+
+def test_student_writes_invalidate_the_cache(client):
+    student_id = add_students(1)[0]
+    url = "/api/student/" + str(student_id)
+    assert client.get(url).json["first_name"] == "Student 0"
+
+    response = client.put(url, json = {"first_name": "Renamed", "roll_number": "R0"})
+    assert response.status_code == 200
+    assert client.get(url).json["first_name"] == "Renamed"
+
+    assert client.delete(url).status_code == 200
+    assert client.get(url).status_code == 404
+
+def test_batch_writes_invalidate_the_cache(client):
+    ids = [add_course("A1"), add_course("B1")]
+    urls = ["/api/course/" + str(course_id) for course_id in ids]
+    for url in urls:
+        assert client.get(url).status_code == 200
+
+    response = client.put("/api/course:batch", json = [
+        {"course_id": ids[0], "course_name": "Renamed A", "course_code": "A1"},
+        {"course_id": ids[1], "course_name": "Renamed B", "course_code": "B1"}
+    ])
+    assert response.status_code == 200
+    assert [client.get(url).json["course_name"] for url in urls] == ["Renamed A", "Renamed B"]
+
+    # Freed ids come back on the next insert, as above
+    db.session.execute(db.delete(Course))
+    db.session.commit()
+    response = client.post("/api/course:batch", json = [
+        {"course_name": "New A", "course_code": "A2"},
+        {"course_name": "New B", "course_code": "B2"}
+    ])
+    assert [course["course_id"] for course in response.json["items"]] == ids
+    assert [client.get(url).json["course_code"] for url in urls] == ["A2", "B2"]
+
+    assert client.delete("/api/course:batch", json = ids).status_code == 200
+    assert [client.get(url).status_code for url in urls] == [404, 404]
+
+def test_cache_stats_count_hits_misses_and_evictions():
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'COURSE_CACHE_SIZE': 2})
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        urls = ["/api/course/" + str(add_course(code)) for code in ("A1", "B1", "C1")]
+        before = cache_stats(client)
+
+        for url in urls:
+            client.get(url)
+        # Only two entries fit, the first course was evicted and is read again
+        client.get(urls[2])
+        client.get(urls[0])
+
+        after = cache_stats(client)
+        assert after["hits"] - before["hits"] == 1
+        assert after["misses"] - before["misses"] == 4
+        assert after["evictions"] - before["evictions"] == 2
+        assert after["entries"] == 2
+        assert after["max_entries"] == 2
+        db.session.remove()
+
+def test_cache_entries_expire_after_the_ttl(monkeypatch):
+    cache = api.LRUCache(10, 60)
+    now = [1000.0]
+    monkeypatch.setattr(api.time, "monotonic", lambda: now[0])
+
+    cache.set(1, "course", cache.generation)
+    now[0] += 59
+    assert cache.get(1) == "course"
+    now[0] += 2
+    assert cache.get(1) is None
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["entries"] == 0
+
+def test_cache_refuses_a_read_that_started_before_a_write():
+    cache = api.LRUCache(10, 60)
+    generation = cache.generation
+    # A write invalidates the entry while the read is still running
+    cache.invalidate(1)
+    cache.set(1, "old course", generation)
+    assert cache.get(1) is None
+    cache.set(1, "new course", cache.generation)
+    assert cache.get(1) == "new course"
+
+
+def test_metrics_fold_the_shards_of_ended_threads():
+    app = Flask(__name__)
+    metrics = Metrics(app)
+    app.add_url_rule("/ping", "ping", lambda: "pong")
+
+    # One thread per request, like the threaded development server without keep-alive
+    def request():
+        assert app.test_client().get("/ping").status_code == 200
+    for i in range(50):
+        thread = threading.Thread(target = request)
+        thread.start()
+        thread.join()
+
+    requests, in_flight = metrics.collect()
+    assert metrics.shards == []
+    assert requests[("/ping", "GET", 200)][0] == 50
+    assert in_flight == 0
+
+def test_pool_gauges_report_no_negative_overflow(tmp_path):
+    engine = create_engine("sqlite:///" + str(tmp_path / "pool.sqlite3"), poolclass = QueuePool, pool_size = 5)
+    values = pool_gauges(lambda: {"read": engine})()
+    assert values['bind="read",state="overflow"'] == 0
+    assert values['bind="read",state="size"'] == 5
+    engine.dispose()